@@ -0,0 +1,143 @@
+"""
+Checking SVG from asyncio code.
+
+check_bytes and check_file are coroutines which parse and check a document
+in a thread of a bounded pool, so an event loop can have many checks in
+flight without being blocked by any of them:
+
+    from svgcheck import aio
+
+    result = await aio.check_bytes(data, name='figure.svg', timeout=10)
+    if not result.ok:
+        print(result.error_count, result.diagnostics)
+
+A check which times out or whose task is cancelled stops soon after, at the
+next element it would have checked, so it does not keep its thread busy.
+"""
+
+import io
+import os
+import asyncio
+import threading
+import collections
+import concurrent.futures
+
+import lxml.etree
+
+from svgcheck.checksvg import Checker
+
+# The number of threads in the default pool
+max_workers = 4
+
+# The outcome of checking a document
+#   ok          - True if it conforms
+#   error_count - the number of errors found
+#   diagnostics - a tuple of the lines of diagnostics, as svgcheck writes them
+#   output      - the repaired document as bytes when repairing found
+#                 something to repair, otherwise None
+CheckResult = collections.namedtuple('CheckResult', 'ok error_count diagnostics output')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def default_executor():
+    """ The pool checks run in unless given another, made when first needed """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix='svgcheck')
+        return _executor
+
+
+def check_data(data, name, repair, color_threshold, limits, cancel):
+    """
+    Parse and check the document data, returning a CheckResult.  This is the
+    part run in the pool.  External DTDs and entities are never loaded, so a
+    document can't make the check read files or the network.
+    """
+    sink = io.StringIO()
+    checker = Checker(color_threshold=color_threshold, repair=repair, sink=sink, cancel=cancel,
+                      limits=limits)
+    checker.prescan(data, source=name)
+    parser = lxml.etree.XMLParser(dtd_validation=False,
+                                  load_dtd=False,
+                                  no_network=True,
+                                  remove_comments=False,
+                                  remove_pis=True,
+                                  remove_blank_text=False,
+                                  resolve_entities=False,
+                                  strip_cdata=False,
+                                  huge_tree=True)
+    try:
+        tree = lxml.etree.fromstring(data, parser, base_url=name).getroottree()
+    except lxml.etree.XMLSyntaxError as e:
+        checker.log.exception('Unable to parse the XML document: ' + name, e.error_log)
+        return CheckResult(False, 1, tuple(sink.getvalue().splitlines()), None)
+
+    ok = checker.check_tree(tree)
+    output = None
+    if not ok and repair:
+        output = lxml.etree.tostring(tree.getroot(), xml_declaration=True, encoding='utf-8',
+                                     pretty_print=True)
+    return CheckResult(ok, checker.error_count, tuple(sink.getvalue().splitlines()), output)
+
+
+def check_path(path, repair, color_threshold, limits, cancel):
+    """ Read the file at path and check it, in the pool """
+    if limits is not None:
+        Checker(sink=io.StringIO(), limits=limits).prescan(size=os.path.getsize(path),
+                                                           source=path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    return check_data(data, path, repair, color_threshold, limits, cancel)
+
+
+async def run_check(function, args, timeout, executor):
+    """
+    Run function(*args, cancel) in executor, waiting at most timeout seconds.
+    If the wait is cancelled or times out the check is told to stop.
+    """
+    cancel = threading.Event()
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(executor or default_executor(), function, *args, cancel)
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except (asyncio.CancelledError, asyncio.TimeoutError):
+        # The check raises checksvg.Cancelled in its thread, which nothing
+        # waits for any more
+        cancel.set()
+        raise
+
+
+async def check_bytes(data, name='<bytes>', repair=False, color_threshold=None, timeout=None,
+                      executor=None, limits=None):
+    """
+    Check the document held in data, naming it name in the diagnostics.
+
+    repair          - also return the repaired document if it needs repairs
+    color_threshold - as for Checker
+    timeout         - seconds to wait before giving up with
+                      asyncio.TimeoutError, None to wait for as long as it
+                      takes
+    executor        - a concurrent.futures.ThreadPoolExecutor to check in
+                      instead of the default pool of max_workers threads
+    limits          - checksvg.Limits on the document, checksvg.LimitExceeded
+                      is raised if it goes over one
+
+    Returns a CheckResult.
+    """
+    return await run_check(check_data, (data, name, repair, color_threshold, limits), timeout,
+                           executor)
+
+
+async def check_file(path, repair=False, color_threshold=None, timeout=None, executor=None,
+                     limits=None):
+    """
+    Check the document in the file at path, as check_bytes does.  The file is
+    read in the pool too, after its size is checked against the limits.
+    Raises OSError if it can't be read.
+    """
+    return await run_check(check_path, (path, repair, color_threshold, limits), timeout,
+                           executor)
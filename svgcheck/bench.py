@@ -0,0 +1,270 @@
+"""
+Benchmarks for svgcheck.
+
+Times the three phases of checking a document separately - parsing it with
+XmlRfcParser.parse, checking it with checkTree and serializing the repaired
+tree with lxml.etree.tostring - and records how much the peak memory of the
+process grew in each.  This is run over the SVG fixtures in Tests and over
+generated SVG documents of 1k and 100k elements, or the sizes given by
+--sizes, in three shapes:
+
+    flat   - many sibling elements, some of which need repairing
+    deep   - chains of nested g elements
+    attrs  - elements with many attributes and style properties
+
+Each document is benchmarked in a fresh process so the memory figures are
+its own.  Documents of a million elements are worth running now and then,
+but an attrs document of that size needs several GB of memory:
+
+    python bench.py --sizes 1000000 --kinds flat,deep --no-fixtures
+
+Run it from the svgcheck directory:
+
+    python bench.py --save baseline.json
+    ... change things ...
+    python bench.py --compare baseline.json
+
+--compare exits with status 1 if a phase got slower, or grew the peak
+memory more, than in the baseline by more than the tolerance.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import glob
+import optparse
+import subprocess
+
+# Generated documents are written here
+bench_dir = os.path.join('Temp', 'bench')
+
+# The phases of checking a document, in order
+phases = ('parse', 'check', 'serialize')
+
+# Depth of each chain of g elements in the deep documents.  libxml2 refuses
+# documents nested deeper than 256 elements unless told otherwise.
+deep_chain = 200
+
+# Timings shorter than this (in seconds) are too noisy to compare
+min_compare_time = 0.001
+
+# Nor are peak memory growths smaller than this (in KB)
+min_compare_memory = 1024
+
+
+def flat_elements(n):
+    """ n sibling elements, a mix of conforming ones and ones to repair """
+    shapes = ['<rect x="1" y="1" width="10" height="10" fill="black"/>',
+              '<rect x="2" y="2" width="10" height="10" fill="red"/>',
+              '<circle cx="5" cy="5" r="4" stroke="#888888" fill="none"/>',
+              '<text x="1" y="9" font-family="Arial, sans-serif">label</text>',
+              '<path d="M 0 0 L 10 10" stroke="blue"/>',
+              '<foreignObject width="1" height="1"/>']
+    for i in range(n):
+        yield shapes[i % len(shapes)]
+
+
+def deep_elements(n):
+    """ n elements in chains of nested g elements """
+    while n > 0:
+        depth = min(n, deep_chain)
+        yield '<g fill="black">' * (depth - 1) + '<rect width="1" height="1"/>'
+        yield '</g>' * (depth - 1)
+        n -= depth
+
+
+def attrs_elements(n):
+    """ n elements with many attributes and style properties """
+    for i in range(n):
+        yield ('<rect id="r{0}" x="{1}" y="{1}" width="10" height="10" rx="1" ry="1"'
+               ' fill="#{2:06x}" stroke="rgb({3},{3},{3})" stroke-width="0.5"'
+               ' stroke-linecap="round" stroke-linejoin="round" opacity="0.5"'
+               ' transform="translate(1,1)" visibility="visible"'
+               ' style="fill-rule:evenodd;font-weight:bold;stroke-dasharray:1,2;'
+               'fill-opacity:0.5"/>'.format(i, i % 100, i % 0xffffff, i % 256))
+
+
+generators = {'flat': flat_elements, 'deep': deep_elements, 'attrs': attrs_elements}
+
+
+def generate(kind, n):
+    """ Write the kind of document with n elements, returning its path """
+    path = os.path.join(bench_dir, '{0}-{1}.svg'.format(kind, n))
+    if not os.path.exists(path):
+        os.makedirs(bench_dir, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                    '<svg xmlns="http://www.w3.org/2000/svg" version="1.2" baseProfile="tiny"'
+                    ' viewBox="0 0 1000 1000">\n')
+            for element in generators[kind](n):
+                f.write(element)
+                f.write('\n')
+            f.write('</svg>\n')
+    return path
+
+
+def peak_memory():
+    """ The peak resident set size of this process in KB, or None if unknown """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS gives bytes, everything else KB
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def run_case(path, repeat):
+    """
+    Benchmark one document in this process, returning the best time of each
+    phase over repeat runs and how much the peak memory grew during each
+    phase of the first run.
+    """
+    import lxml.etree
+    from xml2rfc.parser import XmlRfcParser
+    from svgcheck import log
+    from svgcheck.checksvg import checkTree
+
+    times = dict((phase, None) for phase in phases)
+    memory = dict((phase, None) for phase in phases)
+    log.write_err = io.StringIO()
+    for i in range(repeat):
+        # Checking repairs the tree, so each run starts from a fresh parse
+        marks = [(time.perf_counter(), peak_memory())]
+        parser = XmlRfcParser(path, quiet=True, cache_path=None, no_network=True)
+        tree = parser.parse(remove_comments=False, remove_pis=True, strip_cdata=False).tree
+        marks.append((time.perf_counter(), peak_memory()))
+        checkTree(tree)
+        marks.append((time.perf_counter(), peak_memory()))
+        lxml.etree.tostring(tree.getroot(), xml_declaration=True, encoding='utf-8',
+                            pretty_print=True)
+        marks.append((time.perf_counter(), peak_memory()))
+        log.write_err.truncate(0)
+        log.write_err.seek(0)
+        del tree, parser
+
+        for phase, before, after in zip(phases, marks, marks[1:]):
+            elapsed = after[0] - before[0]
+            if times[phase] is None or elapsed < times[phase]:
+                times[phase] = elapsed
+            if i == 0 and before[1] is not None:
+                memory[phase] = after[1] - before[1]
+    return {'time': times, 'memory': memory}
+
+
+def cases(options):
+    """ The documents to benchmark, as a list of (name, path) """
+    found = []
+    if not options.no_fixtures:
+        paths = glob.glob(os.path.join('Tests', '*.svg'))
+        paths += glob.glob(os.path.join('Tests', '*.xml'))
+        for path in sorted(paths):
+            found.append((os.path.basename(path), path))
+    for size in options.sizes:
+        for kind in options.kinds:
+            found.append(('{0}-{1}'.format(kind, size), generate(kind, size)))
+    return found
+
+
+def benchmark(options):
+    """ Benchmark each case in its own process, returning the results by case """
+    results = {}
+    for name, path in cases(options):
+        child = subprocess.run([sys.executable, __file__, '--run-case', path,
+                                '--repeat', str(options.repeat)],
+                               stdout=subprocess.PIPE, check=True)
+        results[name] = json.loads(child.stdout.decode('utf-8'))
+        report_case(name, results[name])
+    return results
+
+
+def report_case(name, result):
+    line = '{0:<28}'.format(name)
+    for phase in phases:
+        line += ' {0:>10.4f}s'.format(result['time'][phase])
+    for phase in phases:
+        memory = result['memory'][phase]
+        line += ' {0:>9}'.format('-' if memory is None else '{0}K'.format(memory))
+    print(line)
+    sys.stdout.flush()
+
+
+def compare(results, baseline, tolerance):
+    """
+    Report the phases which are slower, or grow the peak memory more, than in
+    the baseline by more than tolerance, a fraction.  Returns the number of
+    them.
+    """
+    worse = 0
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        for phase in phases:
+            now = results[name]['time'][phase]
+            then = baseline[name]['time'][phase]
+            if max(now, then) >= min_compare_time and now > then * (1 + tolerance):
+                print('SLOWER: {0} {1} {2:.4f}s against {3:.4f}s ({4:+.0%})'.format(
+                    name, phase, now, then, now / then - 1))
+                worse += 1
+            now = results[name]['memory'][phase]
+            then = baseline[name].get('memory', {}).get(phase)
+            if now is None or then is None or max(now, then) < min_compare_memory:
+                continue
+            if now > then * (1 + tolerance):
+                print('LARGER: {0} {1} {2}K against {3}K ({4})'.format(
+                    name, phase, now, then,
+                    '{0:+.0%}'.format(now / then - 1) if then else 'new'))
+                worse += 1
+    return worse
+
+
+def main():
+    optionparser = optparse.OptionParser(usage='python bench.py [OPTIONS]')
+    optionparser.add_option('--sizes', default='1000,100000',
+                            help='element counts of the generated documents, such as'
+                            ' 1000,100000,1000000; default: %default')
+    optionparser.add_option('--kinds', default=','.join(sorted(generators)),
+                            help='shapes of the generated documents; default: %default')
+    optionparser.add_option('--no-fixtures', action='store_true', default=False,
+                            help='don\'t benchmark the documents in Tests')
+    optionparser.add_option('--repeat', type='int', default=3,
+                            help='runs of each document, the best is kept; default: %default')
+    optionparser.add_option('--save', metavar='FILE', help='write the results to FILE')
+    optionparser.add_option('--compare', metavar='FILE',
+                            help='compare the results to those saved in FILE')
+    optionparser.add_option('--tolerance', type='float', default=25, metavar='PERCENT',
+                            help='how much slower a phase may be, or how much more its'
+                            ' peak memory may grow, than in the baseline;'
+                            ' default: %default')
+    optionparser.add_option('--run-case', metavar='FILE', help=optparse.SUPPRESS_HELP)
+    (options, args) = optionparser.parse_args()
+
+    if options.run_case:
+        json.dump(run_case(options.run_case, options.repeat), sys.stdout)
+        return 0
+
+    options.sizes = [int(size) for size in options.sizes.split(',') if size]
+    options.kinds = [kind for kind in options.kinds.split(',') if kind]
+    for kind in options.kinds:
+        if kind not in generators:
+            optionparser.error('Unknown kind of document: ' + kind)
+
+    print('{0:<28} {1:>11} {2:>11} {3:>11} {4:>9} {5:>9} {6:>9}'.format(
+        'document', *(phases + phases)))
+    results = benchmark(options)
+
+    if options.save:
+        with open(options.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if options.compare:
+        with open(options.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(results, baseline, options.tolerance / 100.0):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
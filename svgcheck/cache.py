@@ -0,0 +1,138 @@
+"""
+The result cache for svgcheck --cache-results.
+
+The outcome of checking a document - the exit status, the diagnostics and
+the repaired document - is stored under the hash of everything which can
+change it: the bytes of the document, the svgcheck version, the rule tables
+and the options.  Checking an unchanged document again just replays the
+stored outcome.
+
+Entries are JSON files in an svgcheck directory inside the cache directory,
+so -C/--clear-cache removes them along with the xml2rfc cache.  Entries
+which have not been used for too long are removed, then the least recently
+used ones until the cache fits in its size limit.
+"""
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+
+from svgcheck import checksvg
+from svgcheck.__init__ import __version__
+
+# The options which change the outcome of a check
+key_options = ('grey_scale', 'grey_level', 'repair', 'always_emit', 'check_only', 'stream',
+               'quiet', 'verbose', 'format', 'fail_fast', 'max_bytes', 'max_elements',
+               'max_depth', 'max_attribute_length', 'max_figures', 'optimize', 'precision')
+
+
+def cache_directory(cache_path=None):
+    """
+    Find the directory for the result cache.  This is the svgcheck directory
+    in cache_path if that is given, otherwise in the first of the xml2rfc
+    cache directories it can be made in.  Returns None if there is none.
+    """
+    if cache_path:
+        caches = [cache_path]
+    else:
+        from xml2rfc import CACHES
+        caches = [os.path.expanduser(path) for path in CACHES]
+    for dir in caches:
+        path = os.path.join(dir, 'svgcheck')
+        try:
+            os.makedirs(path, exist_ok=True)
+        except OSError:
+            continue
+        if os.access(path, os.W_OK):
+            return path
+    return None
+
+
+class ResultCache(object):
+    """
+    Stored check results, in directory.  max_size is in bytes and max_age in
+    seconds.
+    """
+
+    def __init__(self, directory, max_size, max_age):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+
+    def key(self, chunks, options, source, name=None):
+        """
+        The key for checking the document read from source, given as an
+        iterable of chunks of bytes, with the options.  The source and name
+        are part of the key as they appear in the diagnostics.
+        """
+        digest = hashlib.sha256()
+        settings = [__version__, checksvg.rules_signature(), source, name]
+        settings += [getattr(options, option, None) for option in key_options]
+        digest.update(json.dumps(settings).encode('utf-8'))
+        digest.update(b'\0')
+        for chunk in chunks:
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key):
+        """ The stored entry for key, or None if there is none """
+        path = self.path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        try:
+            # Mark it as recently used
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key, entry):
+        """ Store entry for key.  A cache which can't be written to is ignored. """
+        try:
+            fd, temp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            os.replace(temp, self.path(key))
+        except OSError:
+            pass
+
+    def evict(self):
+        """
+        Remove the entries not used for max_age, then the least recently used
+        ones until what is left fits in max_size.  Returns the number removed.
+        """
+        entries = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.endswith('.json') or entry.name.endswith('.tmp'):
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            continue
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError:
+            return 0
+
+        entries.sort()
+        oldest = time.time() - self.max_age
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for mtime, size, path in entries:
+            if mtime >= oldest and total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
@@ -8,8 +8,15 @@
 from svgcheck import log
 
 import re
+import collections
+import functools
+import hashlib
+import json
+import lxml.etree
 
 import svgcheck.word_properties as wp
+from svgcheck.profiling import phase
+from svgcheck.__init__ import __version__
 
 indent = 4
 errorCount = 0
@@ -18,6 +25,184 @@ trace = True
 
 bad_namespaces = []
 
+# The legal values of a property or basic type, flattened out of the nested
+# tables in word_properties
+#   any      - every value is accepted (the table entry is empty)
+#   literals - the values which are accepted as written
+#   number   - any value is accepted as a <number>
+#   color    - a bad value is replaced using the <color> heuristic
+ValueRule = collections.namedtuple('ValueRule', 'any literals number color')
+
+# What a Checker has worked out about the tag of an element
+#   local - the tag without its namespace
+#   ns    - the namespace, or None
+#   svg   - the namespace is one of wp.svg_urls
+#   known - the element is an allowed one
+TagName = collections.namedtuple('TagName', 'local ns svg known')
+
+# What a Checker has worked out about an attribute name on an element
+#   local, ns, svg - as for TagName
+#   xmlns   - the namespace is one of wp.xmlns_urls
+#   allowed - the element allows the attribute
+#   checked - the value of the attribute is to be checked with value_ok
+AttributeName = collections.namedtuple('AttributeName', 'local ns svg xmlns allowed checked')
+
+# Resource limits for a Checker, each None for no limit
+#   bytes            - the size of a document
+#   elements         - the number of elements in a document, whether or not
+#                      they are in an svg element
+#   depth            - how deeply svg elements are nested
+#   attribute_length - the length of an attribute value
+#   figures          - the number of svg elements in an RFC document
+Limits = collections.namedtuple('Limits', 'bytes elements depth attribute_length figures',
+                                defaults=(None,) * 5)
+
+# Compiled forms of the word_properties tables, rebuilt by compile_rules()
+element_attributes = {}  # element -> frozenset of allowed attributes
+element_children = {}  # element -> frozenset of allowed child elements
+value_rules = {}  # property or basic type -> ValueRule
+
+number_re = re.compile(r"\d+\.\d+%?$")
+
+# A color the heuristic understands: #rgb, #rrggbb or rgb() with numbers or
+# percentages, once lower cased
+color_component = r"\s*([+-]?(?:\d+(?:\.\d*)?|\.\d+))(%?)\s*"
+color_re = re.compile(r"#([0-9a-f]{3}|[0-9a-f]{6})$|rgb\(" +
+                      ",".join([color_component] * 3) + r"\)$")
+
+# The pieces of path data and points lists, each matched where the last one
+# ended.  A number may be followed by whitespace and a comma, which is how
+# numbers are separated.  Arc flags are single digits, so "01" is two flags.
+path_command_re = re.compile(r"\s*([MmZzLlHhVvCcSsQqTtAa])\s*")
+path_number_re = re.compile(r"([+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)\s*,?\s*")
+path_flag_re = re.compile(r"([01])\s*,?\s*")
+path_space_re = re.compile(r"\s*")
+
+# The things in a document which start with <.  Only the last, which is
+# captured, starts an element; comments, CDATA sections, processing
+# instructions and the document type declaration are matched whole so a <
+# inside them is not taken for one.
+markup_re = re.compile(br'<!--.*?-->|<!\[CDATA\[.*?\]\]>|<\?.*?\?>|'
+                       br'<!DOCTYPE[^\[>]*(?:\[.*?\]\s*)?>|<[!/]|(<)', re.S)
+
+# The number of arguments each path command takes, and for A which of them
+# are flags
+path_arguments = {'m': 2, 'z': 0, 'l': 2, 'h': 1, 'v': 1, 'c': 6, 's': 4, 'q': 4, 't': 2,
+                  'a': 7}
+arc_flags = (3, 4)
+
+# The pieces of a CSS declaration list: strings, comments, the punctuation
+# which matters and runs of anything else
+style_token_re = re.compile(r'''"(?:[^"\\]|\\.)*"?|'(?:[^'\\]|\\.)*'?'''  # strings
+                            r"|/\*.*?(?:\*/|$)"  # comments
+                            r'''|[();:]|[^"'/();:]+|/''', re.S)
+
+# Number of (attribute, value) verdicts remembered by value_ok
+value_cache_size = 4096
+
+# The tables the compiled rules were built from
+compiled_from = ()
+
+# Digest of those tables, see rules_signature
+signature = None
+
+
+def as_tuple(values):
+    """
+    Some entries in the tables are written as ('text') which is a string
+    rather than a tuple, treat those as a tuple with one member.
+    """
+    if isinstance(values, str):
+        return (values,) if values else ()
+    return values
+
+
+def compile_values(name, seen=()):
+    """
+    Flatten the legal values for the property or basic type name into a ValueRule
+    """
+    if name in wp.properties:
+        values = as_tuple(wp.properties[name])
+    else:
+        values = as_tuple(wp.basic_types[name])
+    if len(values) == 0:
+        return ValueRule(True, frozenset(), False, False)
+
+    literals = set()
+    number = False
+    color = name == "<color>"
+    for val in values:
+        if (val in wp.properties or val in wp.basic_types) and val not in seen:
+            rule = compile_values(val, seen + (name,))
+            if rule.any:
+                return rule
+            literals.update(rule.literals)
+            number = number or rule.number
+            color = color or rule.color
+        elif val[0] == "+":
+            number = True
+        else:
+            literals.add(val)
+    return ValueRule(False, frozenset(literals), number, color)
+
+
+def compile_rules():
+    """
+    Build the lookup tables used by check and value_ok from word_properties.
+    This is done once at import, and again by checkTree if one of the tables
+    has been replaced.  Call it after changing the contents of a table.
+    """
+    global compiled_from, signature
+
+    compiled_from = (wp.properties, wp.basic_types, wp.elements, wp.element_children,
+                     wp.color_map, wp.color_default, wp.named_colors, wp.style_properties,
+                     wp.property_defaults, wp.inherited_properties)
+    signature = None
+    cached_value_ok.cache_clear()
+    value_allowed.cache_clear()
+    color_verdict.cache_clear()
+    parse_style.cache_clear()
+    value_rules.clear()
+    for name in list(wp.properties) + list(wp.basic_types):
+        value_rules[name] = compile_values(name)
+
+    properties = frozenset(wp.properties)
+    element_attributes.clear()
+    for element, attributes in wp.elements.items():
+        allowed = set()
+        for attr in as_tuple(attributes):
+            if attr in wp.basic_types:
+                allowed.update(as_tuple(wp.basic_types[attr]))
+            else:
+                allowed.add(attr)
+        element_attributes[element] = frozenset(allowed) | properties
+
+    element_children.clear()
+    for element, children in wp.element_children.items():
+        element_children[element] = frozenset(as_tuple(children))
+
+
+def rules_changed():
+    """ Has one of the word_properties tables been replaced since compile_rules? """
+    current = (wp.properties, wp.basic_types, wp.elements, wp.element_children,
+               wp.color_map, wp.color_default, wp.named_colors, wp.style_properties,
+               wp.property_defaults, wp.inherited_properties)
+    return any(a is not b for a, b in zip(current, compiled_from))
+
+
+def rules_signature():
+    """
+    A digest of the rule tables, which changes whenever the rules do.  It is
+    worked out on first use after compile_rules.
+    """
+    global signature
+
+    if rules_changed():
+        compile_rules()
+    if signature is None:
+        signature = hashlib.sha256(repr(compiled_from).encode('utf-8')).hexdigest()
+    return signature
+
 
 def maybefloat(f):
     try:
@@ -26,38 +211,73 @@ def maybefloat(f):
         return None
 
 
-def modify_style(node):
+def split_style(style):
     """
-    For style properties, we want to pull it apart and then make individual attributes
+    Split the declarations in a style attribute, which are separated by
+    semicolons.  A colon, semicolon or parenthesis inside a quoted string or
+    parentheses, as in url(http://example.com/a.svg), is part of the value,
+    and comments are dropped.  Returns a list of (property, value) pairs;
+    for a declaration which is not property:value the property is None and
+    the value is the text of the declaration.  Empty declarations are left
+    out.
     """
-    log.note("modify_style check '{0}' in '{1}'".format(node.attrib["style"], node.tag))
+    declarations = []
+    text = []  # Text of the declaration so far
+    colons = []  # Where in text the colons outside of parentheses are
+    depth = 0
+    for token in style_token_re.findall(style) + [";"]:
+        if token.startswith("/*"):
+            continue
+        if depth == 0 and token == ";":
+            declaration = "".join(text)
+            if len(colons) == 1:
+                name = "".join(text[:colons[0]]).strip()
+                value = "".join(text[colons[0] + 1:]).strip()
+                if name:
+                    declarations.append((name, value))
+                else:
+                    declarations.append((None, declaration))
+            elif declaration.strip():
+                declarations.append((None, declaration))
+            text = []
+            colons = []
+            continue
+        if token == "(":
+            depth += 1
+        elif token == ")" and depth > 0:
+            depth -= 1
+        elif token == ":" and depth == 0:
+            colons.append(len(text))
+        text.append(token)
+    return declarations
 
-    style_props = node.attrib["style"].rstrip(";").split(";")
-    props_to_check = wp.style_properties
 
-    for prop in style_props:
-        # print("prop = %s" %  prop)
-        v = prop.split(":")
-        if len(v) != 2:
-            log.error(
-                "Malformed field '{0}' in style attribute found. Field removed.".format(
-                    v
-                ),
-                where=node,
-            )
-            continue
-        p = v[0].strip()
-        v = v[1].strip()  # May have leading blank
-        log.note("   modify_style - p={0}  v={1}".format(p, v))
-        # we will deal with the change of values later when the attribute list is processed.
-        if p in props_to_check:
-            log.error(
-                "Style property '{0}' promoted to attribute".format(p), where=node
-            )
-            node.attrib[p] = v
+@functools.lru_cache(maxsize=value_cache_size)
+def parse_style(style):
+    """
+    The declarations of a style attribute, classified against
+    wp.style_properties.  Returns a tuple of (action, property, value) where
+    action is "promote" for properties which become attributes, "remove" for
+    the others and "malformed" for declarations which could not be split, in
+    which case value is the text of the declaration.  Styles are usually
+    repeated from element to element, so each is only parsed once.
+    """
+    parsed = []
+    for name, value in split_style(style):
+        if name is None:
+            parsed.append(("malformed", None, value))
+        elif name in wp.style_properties:
+            parsed.append(("promote", name, value))
         else:
-            log.error("Style property '{0}' removed".format(p), where=node)
-    del node.attrib["style"]
+            parsed.append(("remove", name, value))
+    return tuple(parsed)
+
+
+def modify_style(node):
+    """
+    For style properties, we want to pull it apart and then make individual attributes
+    """
+    Checker(logger=log.default).modify_style(node.attrib, node)
 
 
 def value_ok(obj, v):
@@ -70,43 +290,33 @@ def value_ok(obj, v):
     to replace the value if it is not.
     """
 
-    log.note("value_ok look for %s in %s" % (v, obj))
-    # Look if the object is a real attribute, or we recursed w/ an
-    # internal type name such as '<color>' (i.e. a basic_type)
-    if obj in wp.properties:
-        values = wp.properties[obj]
-    elif obj in wp.basic_types:
-        values = wp.basic_types[obj]
-    elif isinstance(obj, str):
-        # values to check is a string
-        if obj[0] == "+":
-            n = re.match(r"\d+\.\d+%?$", v)
-            rv = None
-            if n:
-                rv = n.group()
-            return (True, rv)
-        # if obj[0] == '[':
-        #     return check_some_props(obj, v)
-        if v == obj:
+    return Checker(logger=log.default).value_ok(obj, v)
+
+
+@functools.lru_cache(maxsize=value_cache_size)
+def cached_value_ok(obj, v, threshold):
+    """
+    The body of value_ok.  Verdicts are remembered per attribute and value,
+    threshold is part of the key so changing the color threshold is never
+    answered from a stale entry.  As the verdicts are shared by every
+    Checker this must not write any diagnostics.
+    """
+    rule = value_rules.get(obj)
+    if rule is None:
+        # Not a property or basic type, so obj is a single literal value
+        if isinstance(obj, str) and v == obj:
             return (True, v)
         return (False, None)
-    else:  # Unknown attribute
-        return (False, None)
 
-    log.note("  legal value list {0}".format(values))
-    if len(values) == 0:
+    if rule.any:
         # Empty tuples have nothing to check, assume it is correct
         return (True, None)
+    if v in rule.literals:
+        return (True, v)
+    if rule.number:
+        n = number_re.match(v)
+        return (True, n.group() if n else None)
 
-    replaceWith = None
-    for val in values:
-        ok_v, matched_v = value_ok(val, v)
-        if ok_v:
-            return (True, matched_v)
-        if matched_v:
-            replaceWith = matched_v
-
-    log.note(" --- skip to end -- {0}".format(obj))
     v = v.lower()
     if obj == "font-family":
         all = v.split(",")
@@ -117,45 +327,202 @@ def value_ok(obj, v):
         if len(newFonts) == 0:
             newFonts.append("sans-serif")
         return (False, ",".join(newFonts))
-    if obj == "<color>":
-        if v in wp.color_map:
-            return (False, wp.color_map[v])
-
-        # Heuristic conversion of color or grayscale
-        # when we get here, v is a non-conforming color element
-        if ("rgb(" not in v) and v[0] != "#":
-            return (False, wp.color_default)
-        if v[0] == "#" and len(v) == 7:
-            # hexadecimal color code
-            shade = int(v[1:3], 16) + int(v[3:5], 16) + int(v[5:7], 16)
-        elif v[0] == "#" and len(v) == 4:
-            shade = (
-                int(v[1], 16) * 16
-                + int(v[1], 16)
-                + int(v[2], 16) * 16
-                + int(v[2], 16)
-                + int(v[3], 16) * 16
-                + int(v[3], 16)
-            )
-        elif "rgb(" in v:
-            triple = v.split("(")[1].split(")")[0].split(",")
-            if "%" in triple[0]:
-                shade = sum([int(t.replace("%", "")) * 255 / 100 for t in triple])
+    if rule.color:
+        return (False, color_verdict(v, threshold))
+
+    return (False, None)
+
+
+@functools.lru_cache(maxsize=value_cache_size)
+def value_allowed(obj, v):
+    """
+    Is the value v legal for the attribute obj?  The verdict of
+    cached_value_ok without the work of finding a replacement, for checkers
+    which stop at the first problem.
+    """
+    rule = value_rules.get(obj)
+    if rule is None:
+        return isinstance(obj, str) and v == obj
+    return rule.any or v in rule.literals or rule.number
+
+
+def parse_color(v):
+    """
+    The red, green and blue components of the lower case color v, from 0 to
+    255 though rgb() may go outside that, or None if v is not a color
+    """
+    if v in wp.named_colors:
+        v = wp.named_colors[v]
+    match = color_re.match(v)
+    if match is None:
+        return None
+    digits = match.group(1)
+    if digits is not None:
+        if len(digits) == 3:
+            return tuple(int(c, 16) * 17 for c in digits)
+        return tuple(int(digits[i:i + 2], 16) for i in (0, 2, 4))
+    return tuple(float(match.group(i)) * 255 / 100 if match.group(i + 1)
+                 else float(match.group(i))
+                 for i in (2, 4, 6))
+
+
+@functools.lru_cache(maxsize=value_cache_size)
+def color_verdict(v, threshold):
+    """
+    The replacement for the non-conforming lower case color v.  Heuristic
+    conversion of color or grayscale: white if the sum of its components is
+    above threshold, otherwise the default color.
+    """
+    if v in wp.color_map:
+        return wp.color_map[v]
+    rgb = parse_color(v)
+    if rgb is not None and sum(rgb) > threshold:
+        return "white"
+    return wp.color_default
+
+
+def parse_path(d):
+    """
+    Tokenize the path data d in a single pass.  Returns the segments as a
+    list of (command, numbers), with the numbers as the text they were
+    written as, and None if d is well formed or (position, reason) for the
+    first problem.  The segments are those before the problem, which is as
+    much of the path as is drawn.  A command followed by several sets of
+    arguments gives a segment for each set, and the sets after the first
+    of a moveto are linetos, so they are given as L or l.
+    """
+    segments = []
+    pos = path_space_re.match(d).end()
+    end = len(d)
+    command = None
+    while pos < end:
+        match = path_command_re.match(d, pos)
+        if match is not None:
+            command = match.group(1)
+            pos = match.end()
+            if not segments and command not in 'Mm':
+                return segments, (match.start(1), "path data must start with a moveto")
+        elif command is None:
+            return segments, (pos, "path data must start with a moveto")
+        elif path_arguments[command.lower()] == 0:
+            return segments, (pos, "unexpected '{0}'".format(d[pos]))
+        # else more arguments for the last command
+        count = path_arguments[command.lower()]
+        numbers = []
+        for i in range(count):
+            if command in 'Aa' and i in arc_flags:
+                match = path_flag_re.match(d, pos)
+                what = "a flag of 0 or 1"
             else:
-                shade = sum([int(t) for t in triple])
-        else:
-            shade = 0
+                match = path_number_re.match(d, pos)
+                what = "a number"
+            if match is None:
+                found = "'{0}'".format(d[pos]) if pos < end else "the end"
+                return segments, (pos, "expected {0} for '{1}', found {2}".format(
+                    what, command, found))
+            numbers.append(match.group(1))
+            pos = match.end()
+        segments.append((command, numbers))
+        if command in 'Mm':
+            command = {'M': 'L', 'm': 'l'}[command]
+    return segments, None
 
-        log.note(
-            "Color or grayscale heuristic applied to: '{0}' yields shade: '{1}'".format(
-                v, shade
-            )
-        )
-        if shade > wp.color_threshold:
-            return (False, "white")
-        return (False, wp.color_default)
 
-    return (False, replaceWith)
+def parse_points(points):
+    """
+    Tokenize a points list.  Returns the numbers as the text they were
+    written as, and None if points is well formed or (position, reason) for
+    the first problem.
+    """
+    numbers = []
+    pos = path_space_re.match(points).end()
+    end = len(points)
+    while pos < end:
+        match = path_number_re.match(points, pos)
+        if match is None:
+            return numbers, (pos, "expected a number, found '{0}'".format(points[pos]))
+        numbers.append(match.group(1))
+        pos = match.end()
+    if len(numbers) % 2:
+        return numbers[:-1], (end, "a coordinate has no y")
+    return numbers, None
+
+
+def compact_number(n, precision=None):
+    """
+    The shortest way of writing the number n, given as text, rounded to
+    precision decimal places if that is given: without a + sign, leading
+    zero or trailing zeros after the decimal point
+    """
+    if precision is not None:
+        n = '{0:.{1}f}'.format(round(float(n), precision), precision)
+    elif 'e' in n or 'E' in n:
+        return n.lstrip('+')
+    sign = ''
+    if n[0] in '+-':
+        sign, n = n[0].replace('+', ''), n[1:]
+    if '.' in n:
+        n = n.rstrip('0').rstrip('.')
+    n = n.lstrip('0')
+    if not n:
+        return '0'
+    return sign + n
+
+
+def join_tokens(tokens):
+    """
+    Join the (kind, text) tokens of path data or a points list, where kind is
+    command, number or flag, putting a space between two tokens only where
+    the second would otherwise run on from the first
+    """
+    text = []
+    last = None
+    for kind, token in tokens:
+        if (last is not None and kind != 'command' and last[0] == 'number' and
+                (kind == 'flag' or not (token[0] == '-' or
+                                        (token[0] == '.' and '.' in last[1])))):
+            text.append(' ')
+        text.append(token)
+        last = (kind, token)
+    return ''.join(text)
+
+
+def compact_path(segments, precision=None):
+    """
+    Write the segments of parse_path as compact path data.  A command letter
+    is left out where it is implied by the one before, and numbers are
+    written as briefly as they can be.
+    """
+    tokens = []
+    implied = None
+    for command, numbers in segments:
+        if command != implied or not numbers:
+            tokens.append(('command', command))
+        # After a moveto, further coordinates are lineto
+        implied = {'M': 'L', 'm': 'l'}.get(command, command)
+        for i, n in enumerate(numbers):
+            if command in 'Aa' and i in arc_flags:
+                tokens.append(('flag', n))
+            else:
+                tokens.append(('number', compact_number(n, precision)))
+    return join_tokens(tokens)
+
+
+def compact_points(numbers, precision=None):
+    """ Write the numbers of parse_points as a compact points list """
+    return join_tokens([('number', compact_number(n, precision)) for n in numbers])
+
+
+# The attributes which an optimizing Checker parses and writes back compactly,
+# keyed by element and attribute, with how they are parsed and written
+data_attributes = {
+    ('path', 'd'): (parse_path, compact_path),
+    ('polyline', 'points'): (parse_points, compact_points),
+    ('polygon', 'points'): (parse_points, compact_points),
+}
+
+
+compile_rules()
 
 
 def strip_prefix(element, el):
@@ -176,193 +543,878 @@ def strip_prefix(element, el):
     return element, ns  # return tag, namespace
 
 
-def check(el, depth=0):
+class Cancelled(Exception):
+    """ Raised by a Checker whose cancel event has been set """
+
+
+class Failed(Exception):
+    """ Raised by a fail_fast Checker at the first problem which fails the document """
+
+
+class LimitExceeded(Exception):
+    """ Raised by a Checker when a document goes over one of its Limits """
+
+
+# The rules of Checker.report which make a document fail to conform.  The
+# others are reported but the document may still conform.
+failing_rules = frozenset(['element-namespace', 'element-not-allowed', 'child-not-allowed',
+                           'attribute-not-allowed', 'value-not-allowed'])
+
+
+class Checker(object):
     """
-    Walk the current tree checking to see if all elements pass muster
-    relative to RFC 7996 the RFC Tiny SVG document
+    Checks SVG against RFC 7996, the RFC Tiny SVG document.
+
+    A Checker owns its error count, its options and the Log its diagnostics
+    are written to, so several checkers can be used at the same time from
+    different threads.  The compiled rules and the value_ok cache are shared.
 
-    Return False if the element is to be removed from tree when
-    writing it back out
+    color_threshold - shade above which a color is replaced by white,
+                      defaults to wp.color_threshold
+    repair          - rewrite the tree so it conforms, otherwise leave it as it
+                      was and only report
+    verbose, quiet  - settings for the Log which is written to sink, which
+                      defaults to stderr
+    logger          - a log.Log to use instead of making one
+    profile         - a profiling.Profile to count what is done in, if any
+    figures         - a store of the results of checking the figures in RFC
+                      documents, see check_figure
+    cancel          - a threading.Event, checking stops with Cancelled soon
+                      after it is set
+    fail_fast       - stop at the first problem which fails the document,
+                      without working out how to repair it.  This implies
+                      not repairing.
+    limits          - Limits on the documents checked, checking stops with
+                      LimitExceeded at the first one exceeded
+    optimize        - parse the path data and points lists, reporting any
+                      which are malformed, and when repairing write them back
+                      as compactly as they can be
+    precision       - when optimizing, round the numbers in them to this many
+                      decimal places
     """
-    global errorCount
 
-    log.note("%s tag = %s" % (" " * (depth * indent), el.tag))
-
-    # Check that the namespace is one of the pre-approved ones
-    # ElementTree prefixes elements with default namespace in braces
-
-    element, ns = strip_prefix(el.tag, el)  # name of element
-
-    # namespace for elements must be either empty or svg
-    if ns is not None and ns not in wp.svg_urls:
-        log.warn(
-            "Element '{0}' in namespace '{1}' is not allowed".format(element, ns),
-            where=el,
-        )
-        return False  # Remove this el
-
-    # Is the element in the list of legal elements?
-    log.note("%s element % s: %s" % (" " * (depth * indent), element, el.attrib))
-    if element not in wp.elements:
-        errorCount += 1
-        log.warn("Element '{0}' not allowed".format(element), where=el)
-        return False  # Remove this el
-
-    elementAttributes = wp.elements[element]  # Allowed attributes for element
-
-    # do a re-write of style into individual elements
-    if "style" in el.attrib:
-        modify_style(el)
-
-    attribs_to_remove = []  # Can't remove them inside the iteration!
-    for nsAttrib, val in el.attrib.items():
-        # validate that the namespace of the element is known and ok
-        attr, ns = strip_prefix(nsAttrib, el)
-        log.note("%s attr %s = %s (ns = %s)" % (" " * (depth * indent), attr, val, ns))
-        if ns is not None and ns not in wp.svg_urls:
-            if ns not in wp.xmlns_urls:
-                log.warn(
-                    "Element '{0}' does not allow attributes with namespace '{1}'".format(
-                        element, ns
+    def __init__(self, color_threshold=None, repair=True, verbose=False, quiet=False,
+                 sink=None, logger=None, profile=None, figures=None, cancel=None,
+                 fail_fast=False, limits=None, optimize=False, precision=None):
+        if color_threshold is None:
+            color_threshold = wp.color_threshold
+        self.color_threshold = color_threshold
+        self.repair = repair and not fail_fast
+        self.fail_fast = fail_fast
+        self.log = logger or log.Log(sink, quiet=quiet, verbose=verbose)
+        self.error_count = 0
+        self.profile = profile
+        self.figures = figures
+        self.cancel = cancel
+        self.limits = limits
+        self.optimize = optimize
+        self.precision = precision
+        self.element_count = 0
+        self.clear_names()
+
+    def clear_names(self):
+        """
+        Forget the tag and attribute names worked out so far.  This is done
+        at the start of each check_tree or check_stream, as the rules may
+        have changed since the last.
+        """
+        self.tag_names = {}  # Tag to TagName
+        self.attribute_names = {}  # Element name to attribute name to AttributeName
+
+    def tag_name(self, tag):
+        """ The TagName for tag, which is in Clark notation: {namespace}local """
+        name = self.tag_names.get(tag)
+        if name is None:
+            local, ns = strip_prefix(tag, None)
+            name = TagName(local, ns, ns in wp.svg_urls, local in element_attributes)
+            self.tag_names[tag] = name
+        return name
+
+    def attribute_name(self, element, attribute):
+        """ The AttributeName for attribute on an element called element """
+        names = self.attribute_names.setdefault(element, {})
+        name = names.get(attribute)
+        if name is None:
+            local, ns = strip_prefix(attribute, None)
+            allowed = local in element_attributes.get(element, ())
+            name = AttributeName(local, ns, ns in wp.svg_urls, ns in wp.xmlns_urls, allowed,
+                                 local in wp.properties and not value_rules[local].any)
+            names[attribute] = name
+        return name
+
+    def value_ok(self, obj, v):
+        """
+        Check that the value v is a legal value for the attribute obj, using
+        this checker's color threshold.  See value_ok.
+        """
+        if self.profile is not None:
+            self.profile.value_ok_calls += 1
+        result = cached_value_ok(obj, v, self.color_threshold)
+        self.log.note("value_ok look for %s in %s gives %s", v, obj, result)
+        return result
+
+    def report(self, severity, rule, message, where, element=None, attribute=None, old=None,
+               new=None, action=None):
+        """
+        Write a diagnostic about the element where, or about the whole
+        document if where is None, to the log as an error or a warning
+        depending on severity.  The Log also gets it as a dict, which a Log
+        writing text only counts, of:
+
+        rule      - an id for the kind of problem, such as value-not-allowed
+        severity  - error or warning
+        message   - the message as written
+        file      - the file the element is in
+        line      - the line the element starts on
+        element   - the name of the element, if the problem is with one
+        attribute - the name of the attribute or style property, if any
+        old       - the value which was not allowed, if any
+        new       - the value it was replaced with, if any
+        action    - what was done about it, one of removed, replaced,
+                    promoted or added, if anything.  A Checker which is not
+                    repairing gives what it would have done.
+        """
+        kwargs = {'where': where} if where is not None else {}
+        if severity == 'error':
+            self.log.error(message, **kwargs)
+        else:
+            self.log.warn(message, **kwargs)
+        self.log.diagnostic({'rule': rule,
+                             'severity': severity,
+                             'message': message,
+                             'file': (log.make_relative(where.base or "<unknown>")
+                                      if where is not None else None),
+                             'line': where.sourceline if where is not None else None,
+                             'element': element,
+                             'attribute': attribute,
+                             'old': old,
+                             'new': new,
+                             'action': action})
+        if self.fail_fast and rule in failing_rules:
+            raise Failed()
+
+    def exceeded(self, message, where=None):
+        """ Report that a limit has been exceeded and stop checking """
+        self.report('error', 'limit-exceeded', 'Resource limit exceeded: ' + message, where)
+        raise LimitExceeded(message)
+
+    def prescan(self, data=None, size=None, source=None):
+        """
+        Cheaply check a document against the limits before it is parsed.  size
+        is its size in bytes, the length of data if that is given, and source
+        names it in the diagnostic.  data may have been cut short after the
+        limit, so only a size which is given is said in the diagnostic.  The
+        number of elements is the number of start tags in data.  Entities can
+        add more, which are found once the document has been parsed.
+        """
+        limits = self.limits
+        if limits is None:
+            return
+        source = source or 'the document'
+        if limits.bytes is not None:
+            if size is not None and size > limits.bytes:
+                self.exceeded('{0} is {1} bytes, more than {2}'.format(source, size,
+                                                                       limits.bytes))
+            if data is not None and len(data) > limits.bytes:
+                self.exceeded('{0} is more than {1} bytes'.format(source, limits.bytes))
+        # Counting every < first is far quicker, and is enough for most documents
+        if (limits.elements is not None and data is not None and
+                data.count(b'<') > limits.elements):
+            tags = sum(1 for match in markup_re.finditer(data) if match.group(1))
+            if tags > limits.elements:
+                self.exceeded('{0} has {1} elements, more than {2}'.format(
+                    source, tags, limits.elements))
+
+    def check_limits(self, el, depth):
+        """ Check the element el, at depth in its svg element, against the limits """
+        limits = self.limits
+        if limits.depth is not None and depth > limits.depth:
+            self.exceeded('elements nested more than {0} deep'.format(limits.depth), el)
+        if limits.attribute_length is not None:
+            for attribute, value in el.items():
+                if len(value) > limits.attribute_length:
+                    self.exceeded("the attribute '{0}' is {1} characters long, more than"
+                                  " {2}".format(attribute, len(value),
+                                                limits.attribute_length), el)
+
+    def check_figures(self, count, where):
+        """ Check the number of svg elements in an RFC document against the limits """
+        if (self.limits is not None and self.limits.figures is not None and
+                count > self.limits.figures):
+            self.exceeded('more than {0} svg elements'.format(self.limits.figures), where)
+
+    def modify_style(self, attrs, node):
+        """
+        For style properties, we want to pull it apart and then make individual attributes
+        attrs holds the attributes of node, and is changed in place
+        """
+        self.log.note("modify_style check '%s' in '%s'", attrs["style"], node.tag)
+        profile = self.profile
+
+        for action, p, v in parse_style(attrs["style"]):
+            if action == "malformed":
+                self.report(
+                    'error', 'style-malformed',
+                    "Malformed field '{0}' in style attribute found. Field removed.".format(
+                        v.split(":")
                     ),
-                    where=el,
+                    node, attribute='style', old=v, action='removed',
                 )
-                attribs_to_remove.append(nsAttrib)
-            continue
+                continue
+            self.log.note("   modify_style - p=%s  v=%s", p, v)
+            # we will deal with the change of values later when the attribute list is processed.
+            if action == "promote":
+                self.report('error', 'style-promoted',
+                            "Style property '{0}' promoted to attribute".format(p), node,
+                            attribute=p, old=v, action='promoted')
+                attrs[p] = v
+                if profile is not None:
+                    profile.attributes[p, 'promoted'] += 1
+            else:
+                self.report('error', 'style-removed', "Style property '{0}' removed".format(p),
+                            node, attribute=p, old=v, action='removed')
+                if profile is not None:
+                    profile.attributes[p, 'removed'] += 1
+        del attrs["style"]
+        if profile is not None:
+            profile.attributes['style', 'removed'] += 1
 
-        # look to see if the attribute is either an attribute for a specific
-        # element or is an attribute generically for all properties
-        if (attr not in elementAttributes) and (attr not in wp.properties):
-            errorCount += 1
-            log.warn(
-                "The element '{0}' does not allow the attribute '{1}',"
-                " attribute to be removed.".format(element, attr),
-                where=el,
-            )
-            attribs_to_remove.append(nsAttrib)
-
-        # Now check if the attribute is a generic property
-        elif attr in wp.properties:
-            vals = wp.properties[attr]
-            # log.note("vals = " + vals +  "<<<<<")
-
-            #  Do method #1 of checking if the value is legal - not currently used.
-            if vals and vals[0] == "[" and False:
-                # ok, new_val = check_some_props(attr, val, depth)
-                # if not ok:
-                #    el.attrib[attr] = new_val[1:]
-                pass
+    def optimize_data(self, el, element, attr, val):
+        """
+        Parse the path data or points list val of the attribute attr, and
+        report it if it is malformed.  Returns what it is to be replaced
+        with: as much of it as is well formed, written compactly, or None if
+        none of it is and the attribute is to be removed.
+        """
+        parse, compact = data_attributes[element, attr]
+        parsed, problem = parse(val)
+        new_val = compact(parsed, self.precision) if parsed else None
+        if problem is not None:
+            position, reason = problem
+            message = "The attribute '{0}' is malformed at character {1}: {2}".format(
+                attr, position, reason)
+            if new_val is not None:
+                self.report('warning', 'data-malformed',
+                            message + ", replaced with '{0}'".format(new_val), el,
+                            element=element, attribute=attr, old=val, new=new_val,
+                            action='replaced')
             else:
-                ok, new_val = value_ok(attr, val)
-                if vals and not ok:
-                    errorCount += 1
+                self.report('warning', 'data-malformed', message + ", attribute to be removed",
+                            el, element=element, attribute=attr, old=val, action='removed')
+        elif self.log.is_verbose():
+            self.log.note("%s of %s compacted from %d to %d characters", attr, element,
+                          len(val), len(new_val))
+        return new_val
+
+    def check_element(self, el, depth):
+        """
+        Check a single element, its namespace and its attributes, rewriting the
+        attributes as needed.  The children are left to the caller.
+
+        Return None if the element is to be removed from the tree, otherwise
+        return the name of the element and the set of children it allows
+        """
+        verbose = self.log.is_verbose()
+        if verbose:
+            pad = " " * (depth * indent)
+            self.log.note("%s tag = %s", pad, el.tag)
+
+        # Check that the namespace is one of the pre-approved ones
+        # ElementTree prefixes elements with default namespace in braces
+
+        if self.limits is not None:
+            self.check_limits(el, depth)
+
+        tag = self.tag_names.get(el.tag) or self.tag_name(el.tag)
+        element, ns = tag.local, tag.ns  # name of element
+        profile = self.profile
+        if profile is not None:
+            profile.elements[element, 'visited'] += 1
+
+        # namespace for elements must be either empty or svg
+        if ns is not None and not tag.svg:
+            self.report(
+                'warning', 'element-namespace',
+                "Element '{0}' in namespace '{1}' is not allowed".format(element, ns),
+                el, element=element, action='removed',
+            )
+            if profile is not None:
+                profile.elements[element, 'removed'] += 1
+            return None  # Remove this el
+
+        # Is the element in the list of legal elements?
+        if verbose:
+            self.log.note("%s element % s: %s", pad, element, el.attrib)
+        if not tag.known:
+            self.error_count += 1
+            self.report('warning', 'element-not-allowed',
+                        "Element '{0}' not allowed".format(element), el, element=element,
+                        action='removed')
+            if profile is not None:
+                profile.elements[element, 'removed'] += 1
+            return None  # Remove this el
+
+        names = self.attribute_names.get(element) or {}
+
+        # When not repairing, work on a copy of the attributes
+        attrs = el.attrib if self.repair else dict(el.attrib)
+
+        # do a re-write of style into individual elements
+        if "style" in attrs:
+            with phase(profile, 'modify_style'):
+                self.modify_style(attrs, el)
+
+        attribs_to_remove = []  # Can't remove them inside the iteration!
+        for nsAttrib, val in list(attrs.items()):
+            # validate that the namespace of the element is known and ok
+            name = names.get(nsAttrib) or self.attribute_name(element, nsAttrib)
+            attr, ns = name.local, name.ns
+            if verbose:
+                self.log.note("%s attr %s = %s (ns = %s)", pad, attr, val, ns)
+            if profile is not None:
+                profile.attributes[attr, 'visited'] += 1
+            if ns is not None and not name.svg:
+                if not name.xmlns:
+                    self.report(
+                        'warning', 'attribute-namespace',
+                        "Element '{0}' does not allow attributes with namespace '{1}'".format(
+                            element, ns
+                        ),
+                        el, element=element, attribute=nsAttrib, old=val, action='removed',
+                    )
+                    attribs_to_remove.append(nsAttrib)
+                continue
+
+            # look to see if the attribute is either an attribute for a specific
+            # element or is an attribute generically for all properties
+            if not name.allowed:
+                self.error_count += 1
+                self.report(
+                    'warning', 'attribute-not-allowed',
+                    "The element '{0}' does not allow the attribute '{1}',"
+                    " attribute to be removed.".format(element, attr),
+                    el, element=element, attribute=attr, old=val, action='removed',
+                )
+                attribs_to_remove.append(nsAttrib)
+
+            # Now check if the attribute is a generic property
+            elif name.checked and self.fail_fast:
+                if profile is not None:
+                    profile.value_ok_calls += 1
+                if not value_allowed(attr, val):
+                    self.error_count += 1
+                    self.report(
+                        'warning', 'value-not-allowed',
+                        "The attribute '{1}' does not allow the value '{0}'".format(val, attr),
+                        el, element=element, attribute=attr, old=val,
+                    )
+            elif name.checked:
+                ok, new_val = self.value_ok(attr, val)
+                if not ok:
+                    self.error_count += 1
                     if new_val is not None:
-                        el.attrib[attr] = new_val
-                        log.warn(
+                        attrs[attr] = new_val
+                        if profile is not None:
+                            profile.attributes[attr, 'rewritten'] += 1
+                        self.report(
+                            'warning', 'value-not-allowed',
                             "The attribute '{1}' does not allow the value '{0}',"
                             " replaced with '{2}'".format(val, attr, new_val),
-                            where=el,
+                            el, element=element, attribute=attr, old=val, new=new_val,
+                            action='replaced',
                         )
                     else:
                         attribs_to_remove.append(nsAttrib)
-                        log.warn(
+                        self.report(
+                            'warning', 'value-not-allowed',
                             "The attribute '{1}' does not allow the value '{0}',"
                             " attribute to be removed".format(val, attr),
-                            where=el,
+                            el, element=element, attribute=attr, old=val, action='removed',
                         )
 
-    for attrib in attribs_to_remove:
-        del el.attrib[attrib]
+            elif self.optimize and (element, attr) in data_attributes:
+                new_val = self.optimize_data(el, element, attr, val)
+                if new_val is None:
+                    attribs_to_remove.append(nsAttrib)
+                elif new_val != val:
+                    attrs[nsAttrib] = new_val
+                    if profile is not None:
+                        profile.attributes[attr, 'rewritten'] += 1
 
-    # Need to have a viewBox on the root
-    if depth == 0:
-        if el.get("viewBox"):
-            pass
-        else:
-            log.warn(
-                "The attribute viewBox is required on the root svg element", where=el
-            )
-            svgw = maybefloat(el.get("width"))
-            svgh = maybefloat(el.get("height"))
-            try:
-                if svgw and svgh:
-                    newValue = "0 0 %s %s" % (svgw, svgh)
-                    log.warn(
-                        "Trying to put in the attribute with value '{0}'".format(
-                            newValue
+        for attrib in attribs_to_remove:
+            del attrs[attrib]
+            if profile is not None:
+                profile.attributes[self.attribute_name(element, attrib).local, 'removed'] += 1
+
+        # Need to have a viewBox on the root
+        if depth == 0:
+            if el.get("viewBox"):
+                pass
+            else:
+                self.report('warning', 'viewbox-missing',
+                            "The attribute viewBox is required on the root svg element", el,
+                            element=element, attribute='viewBox')
+                svgw = maybefloat(el.get("width"))
+                svgh = maybefloat(el.get("height"))
+                try:
+                    if svgw and svgh:
+                        newValue = "0 0 %s %s" % (svgw, svgh)
+                        self.report(
+                            'warning', 'viewbox-missing',
+                            "Trying to put in the attribute with value '{0}'".format(
+                                newValue
+                            ),
+                            el, element=element, attribute='viewBox', new=newValue,
+                            action='added',
+                        )
+                        if self.repair:
+                            el.set("viewBox", newValue)
+                except ValueError as e:
+                    self.report('error', 'viewbox-size', "Error when calculating SVG size: %s" % e,
+                                el, element=element, attribute='viewBox')
+
+        return element, element_children.get(element, ())
+
+    def check(self, el, depth=0):
+        """
+        Walk the current tree checking to see if all elements pass muster
+        relative to RFC 7996 the RFC Tiny SVG document
+
+        The walk uses an explicit stack rather than recursion, so deeply nested
+        documents can not hit the recursion limit.  Each entry on the stack holds
+        an element, its name, the children it allows, an iterator over its
+        children and the list of children to remove once the iterator is done.
+
+        Return False if the element is to be removed from tree when
+        writing it back out.  If the checker is not repairing, nothing is
+        actually removed.
+        """
+        checked = self.check_element(el, depth)
+        if checked is None:
+            return False
+        verbose = self.log.is_verbose()
+        profile = self.profile
+        cancel = self.cancel
+
+        stack = [(el, checked[0], checked[1], iter(el), [], depth)]
+        while True:
+            if cancel is not None and cancel.is_set():
+                raise Cancelled()
+            el, element, allowed_children, children, els_to_rm, depth = stack[-1]
+            for child in children:
+                if verbose:
+                    self.log.note("%schild, tag = %s", " " * (depth * indent), child.tag)
+                if not isinstance(child.tag, str):
+                    continue
+                child_name = self.tag_names.get(child.tag) or self.tag_name(child.tag)
+                ch_tag, ns = child_name.local, child_name.ns
+                if not child_name.svg:
+                    self.report(
+                        'warning', 'element-namespace',
+                        "The namespace {0} is not permitted for svg elements.".format(ns),
+                        child, element=ch_tag, action='removed',
+                    )
+                    els_to_rm.append(child)
+                    if profile is not None:
+                        profile.elements[ch_tag, 'removed'] += 1
+                    continue
+
+                if ch_tag not in allowed_children:
+                    self.report(
+                        'warning', 'child-not-allowed',
+                        "The element '{0}' is not allowed as a child of '{1}'".format(
+                            ch_tag, element
                         ),
-                        where=el,
+                        child, element=ch_tag, action='removed',
                     )
-                    el.set("viewBox", newValue)
-            except ValueError as e:
-                log.error("Error when calculating SVG size: %s" % e, where=el)
+                    els_to_rm.append(child)
+                    if profile is not None:
+                        profile.elements[ch_tag, 'removed'] += 1
+                    continue
 
-    els_to_rm = []  # Can't remove them inside the iteration!
-    if element in wp.element_children:
-        allowed_children = wp.element_children[element]
-    else:
-        allowed_children = []
+                checked = self.check_element(child, depth + 1)
+                if checked is None:
+                    els_to_rm.append(child)
+                    continue
+                # Descend, this element's iterator is picked up again afterwards
+                stack.append((child, checked[0], checked[1], iter(child), [], depth + 1))
+                break
+            else:
+                # All of the children of el have been checked
+                stack.pop()
+                if self.repair:
+                    for child in els_to_rm:
+                        el.remove(child)
+                if not stack:
+                    return len(els_to_rm) == 0
+                if len(els_to_rm) != 0:
+                    stack[-1][4].append(el)
+                    if profile is not None:
+                        profile.elements[element, 'removed'] += 1
 
-    for child in el:
-        log.note("%schild, tag = %s" % (" " * (depth * indent), child.tag))
-        if not isinstance(child.tag, str):
-            continue
-        ch_tag, ns = strip_prefix(child.tag, el)
-        if ns not in wp.svg_urls:
-            log.warn(
-                "The namespace {0} is not permitted for svg elements.".format(ns),
-                where=child,
-            )
-            els_to_rm.append(child)
-            continue
+    def prune(self, svg):
+        """
+        Make the repaired svg element smaller without changing how it is
+        drawn, using the property tables in word_properties.  Working up from
+        the leaves, g and defs elements without an id which are empty are
+        removed, and an inherited property which the children of an svg or g
+        element all give the same value is moved up to it.  Then, working
+        down, attributes which give the value an element would have anyway
+        are removed.  An element a use element refers to, and what is in a
+        defs element, inherits from where it is used, so they are left alone.
+        """
+        profile = self.profile
+        verbose = self.log.is_verbose()
+        inherited = frozenset(wp.inherited_properties)
+        defaults = wp.property_defaults
 
-        if ch_tag not in allowed_children:
-            log.warn(
-                "The element '{0}' is not allowed as a child of '{1}'".format(
-                    ch_tag, element
-                ),
-                where=child,
-            )
-            els_to_rm.append(child)
-        elif not check(child, depth + 1):
-            els_to_rm.append(child)
+        names = collections.OrderedDict()  # Element to its name, in document order
+        for el in svg.iter():
+            if isinstance(el.tag, str):
+                names[el] = self.tag_name(el.tag).local
+        referenced = set()
+        for el, name in names.items():
+            if name == 'use':
+                for attr, value in el.items():
+                    if strip_prefix(attr, None)[0] == 'href' and value.startswith('#'):
+                        referenced.add(value[1:])
+        fixed = set()  # The elements whose attributes are left alone
+        for el in names:
+            parent = el.getparent()
+            if el.get('id') in referenced or (el is not svg and (parent in fixed or
+                                                                 names.get(parent) == 'defs')):
+                fixed.add(el)
+
+        for el in reversed(names):
+            name = names[el]
+            children = [child for child in el if child in names]
+            if name in ('g', 'defs') and el is not svg and not children and el.get('id') is None:
+                # Keep the layout of the text around it
+                previous, parent = el.getprevious(), el.getparent()
+                if previous is not None:
+                    previous.tail = el.tail
+                else:
+                    parent.text = el.tail
+                parent.remove(el)
+                if verbose:
+                    self.log.note("Removed empty %s at line %s", name, el.sourceline)
+                if profile is not None:
+                    profile.elements[name, 'removed'] += 1
+                continue
+            if name not in ('svg', 'g') or el in fixed:
+                continue
+            drawn = [child for child in children if names[child] not in ('title', 'desc')]
+            if len(drawn) < 2 or any(child in fixed for child in drawn):
+                continue
+            for attr in wp.inherited_properties:
+                value = drawn[0].get(attr)
+                if (value is None or value == 'inherit' or
+                        attr not in element_attributes.get(name, ()) or
+                        any(child.get(attr) != value for child in drawn)):
+                    continue
+                el.set(attr, value)
+                for child in drawn:
+                    del child.attrib[attr]
+                if verbose:
+                    self.log.note("Moved %s='%s' from the children of %s at line %s to it",
+                                  attr, value, name, el.sourceline)
+                if profile is not None:
+                    profile.attributes[attr, 'removed'] += len(drawn) - 1
+
+        given = {svg.getparent(): defaults}  # The inherited values the children of each get
+        for el in svg.iter():
+            if el not in names:
+                continue
+            values = given[el.getparent()]
+            if el not in fixed:
+                for attr, value in el.items():
+                    if attr in inherited:
+                        redundant = value == 'inherit' or value == values.get(attr)
+                    else:
+                        redundant = value == defaults.get(attr)
+                    if redundant:
+                        del el.attrib[attr]
+                        if verbose:
+                            self.log.note("Removed %s='%s' from %s at line %s, it has no effect",
+                                          attr, value, names[el], el.sourceline)
+                        if profile is not None:
+                            profile.attributes[attr, 'removed'] += 1
+            own = dict((attr, el.get(attr)) for attr in inherited.intersection(el.keys()))
+            given[el] = dict(values, **own) if own else values
+
+    def check_tree(self, tree):
+        """
+        Process the XML tree.  There are two cases to be dealt with
+        1. This is a simple svg at the root - can be either the real namespace or
+           an empty namespace
+        2. This is an rfc tree - and we should only look for real namespaces, but
+           there may be more than one thing to look for.
+        """
+        if rules_changed():
+            compile_rules()
+        cache_before = cached_value_ok.cache_info()
+        self.clear_names()
+
+        self.error_count = 0
+        self.element_count = 0
+        checkOK = True
+        element = tree.getroot().tag
+        if element[0] == "{":
+            element = element[element.rfind("}") + 1:]
+        if self.limits is not None and self.limits.elements is not None:
+            self.element_count = sum(1 for _ in tree.getroot().iter(lxml.etree.Element))
+            if self.element_count > self.limits.elements:
+                self.exceeded('the document has {0} elements, more than {1}'.format(
+                    self.element_count, self.limits.elements), tree.getroot())
+        try:
+            if element == "svg":
+                svgPaths = [tree.getroot()]
+                checkOK = self.check(tree.getroot(), 0)
+            else:
+                # Locate all of the svg elements that we need to check
+
+                svgPaths = tree.getroot().xpath(
+                    "//x:svg", namespaces={"x": "http://www.w3.org/2000/svg"}
+                )
+                self.check_figures(len(svgPaths), tree.getroot())
+
+                for path in svgPaths:
+                    if len(svgPaths) > 1:
+                        self.log.note("Checking svg element at line %s in file %s",
+                                      path.sourceline, path.base)
+                    checkOK = self.check_figure(path)
+
+            if self.optimize and self.repair:
+                for path in svgPaths:
+                    self.prune(path)
+        except Failed:
+            checkOK = False
+
+        self.note_cache_use(cache_before)
+        return self.error_count == 0 and checkOK
+
+    def figure_key(self, svg):
+        """
+        The key for the result of checking the svg element, which changes
+        if the figure, the rules or the line each element starts on relative
+        to the svg element do
+        """
+        digest = hashlib.sha256()
+        settings = [__version__, rules_signature(), self.color_threshold, self.optimize,
+                    self.precision]
+        settings += [el.sourceline - svg.sourceline for el in svg.iter()]
+        digest.update(json.dumps(settings).encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(lxml.etree.tostring(svg, with_tail=False))
+        return digest.hexdigest()
+
+    def check_figure(self, svg):
+        """
+        Check one svg element in an RFC document, using the figures store if
+        there is one.  A figure which has not changed since it was stored gets
+        the stored diagnostics, moved to where the figure now is, instead of
+        being checked again.  When repairing, only figures which needed no
+        repairs are taken from the store, so the others are repaired, and
+        none are when optimizing, as any figure might be made smaller.  The
+        store is not used by a Checker with limits, as a figure taken from
+        it would not count towards them.
+        """
+        figures = self.figures
+        if (figures is None or self.fail_fast or self.limits is not None or
+                any(el.sourceline is None for el in svg.iter())):
+            return self.check(svg, 0)
+
+        key = self.figure_key(svg)
+        entry = figures.get(key)
+        if entry is not None and self.repair and (self.optimize or
+                                                  any(method != 'note'
+                                                      for method, _, _ in entry['records'])):
+            entry = None
+        if entry is None:
+            saved_log = self.log
+            saved_count = self.error_count
+            self.log = log.Recorder(svg.sourceline)
+            self.error_count = 0
+            try:
+                ok = self.check(svg, 0)
+                entry = {'ok': ok, 'errors': self.error_count, 'records': self.log.records}
+            finally:
+                self.log = saved_log
+                self.error_count += saved_count
+            figures.put(key, entry)
+        else:
+            self.error_count += entry['errors']
+        log.replay(entry['records'], self.log, svg.base, svg.sourceline)
+        return entry['ok']
+
+    def note_cache_use(self, cache_before):
+        """ Report how well the value_ok cache did since cache_before was taken """
+        if self.log.is_verbose():
+            cache_after = cached_value_ok.cache_info()
+            hits = cache_after.hits - cache_before.hits
+            lookups = hits + cache_after.misses - cache_before.misses
+            self.log.note("value_ok cache: %d of %d lookups were hits (%.1f%%)",
+                          hits, lookups, 100.0 * hits / lookups if lookups else 0)
+
+    def check_stream(self, events):
+        """
+        Check a document while it is being parsed, without building the whole
+        tree.  events yields ("start", element) and ("end", element) pairs, as
+        lxml.etree.iterparse does when asked for those two events.
+
+        The same warnings are given, in the same order, as check_tree would give
+        for the whole document, but nothing is repaired.  Each element is
+        cleared once it has ended, so memory use does not grow with the size of
+        the document.
+        """
+        if rules_changed():
+            compile_rules()
+        cache_before = cached_value_ok.cache_info()
+        self.clear_names()
+        verbose = self.log.is_verbose()
+        profile = self.profile
+        cancel = self.cancel
+
+        self.error_count = 0
+        self.element_count = 0
+        figures = 0
+        checkOK = True
+        rfc = None  # Is the root something other than an svg element?
+        stack = []  # (element, name, allowed children, failed) for open svg elements
+        skipping = None  # The element whose subtree is not being checked
+        try:
+            for event, el in events:
+                if cancel is not None and cancel.is_set():
+                    raise Cancelled()
+                if event == "start":
+                    self.element_count += 1
+                    if (self.limits is not None and self.limits.elements is not None and
+                            self.element_count > self.limits.elements):
+                        self.exceeded('more than {0} elements'.format(self.limits.elements), el)
+                    if skipping is not None:
+                        continue
+                    if rfc is None:
+                        rfc = self.tag_name(el.tag).local != "svg"
+                        if not rfc:
+                            checked = self.check_element(el, 0)
+                            if checked is None:
+                                checkOK = False
+                                skipping = el
+                            else:
+                                stack.append([el, checked[0], checked[1], False])
+                            continue
+
+                    if not stack:
+                        # Outside of an svg element in an rfc document
+                        if el.tag == "{http://www.w3.org/2000/svg}svg":
+                            figures += 1
+                            self.check_figures(figures, el)
+                            self.log.note("Checking svg element at line %s in file %s",
+                                          el.sourceline, el.base)
+                            checked = self.check_element(el, 0)
+                            if checked is None:
+                                checkOK = False
+                                skipping = el
+                            else:
+                                checkOK = True
+                                stack.append([el, checked[0], checked[1], False])
+                        continue
 
-    if len(els_to_rm) != 0:
-        for child in els_to_rm:
-            el.remove(child)
-        return False
-    return True  # OK
+                    parent = stack[-1]
+                    if verbose:
+                        self.log.note("%schild, tag = %s", " " * ((len(stack) - 1) * indent),
+                                      el.tag)
+                    child_name = self.tag_names.get(el.tag) or self.tag_name(el.tag)
+                    ch_tag, ns = child_name.local, child_name.ns
+                    if not child_name.svg:
+                        self.report(
+                            'warning', 'element-namespace',
+                            "The namespace {0} is not permitted for svg elements.".format(ns),
+                            el, element=ch_tag, action='removed',
+                        )
+                        checked = None
+                        if profile is not None:
+                            profile.elements[ch_tag, 'removed'] += 1
+                    elif ch_tag not in parent[2]:
+                        self.report(
+                            'warning', 'child-not-allowed',
+                            "The element '{0}' is not allowed as a child of '{1}'".format(
+                                ch_tag, parent[1]
+                            ),
+                            el, element=ch_tag, action='removed',
+                        )
+                        checked = None
+                        if profile is not None:
+                            profile.elements[ch_tag, 'removed'] += 1
+                    else:
+                        checked = self.check_element(el, len(stack))
+                    if checked is None:
+                        parent[3] = True
+                        skipping = el
+                    else:
+                        stack.append([el, checked[0], checked[1], False])
+                else:
+                    if skipping is el:
+                        skipping = None
+                    elif stack and stack[-1][0] is el:
+                        _, element, _, failed = stack.pop()
+                        if stack:
+                            stack[-1][3] = stack[-1][3] or failed
+                            if failed and profile is not None:
+                                profile.elements[element, 'removed'] += 1
+                        else:
+                            checkOK = not failed
+
+                    # Done with this element, drop it and any earlier siblings
+                    el.clear(keep_tail=True)
+                    parent = el.getparent()
+                    if parent is not None:
+                        while el.getprevious() is not None:
+                            del parent[0]
+        except Failed:
+            checkOK = False
+
+        self.note_cache_use(cache_before)
+        return self.error_count == 0 and checkOK
+
+
+def check(el, depth=0):
+    """
+    Walk the current tree checking to see if all elements pass muster
+    relative to RFC 7996 the RFC Tiny SVG document, counting errors in
+    errorCount.  See Checker.check.
+    """
+    global errorCount
+
+    checker = Checker(logger=log.default)
+    checker.error_count = errorCount
+    ok = checker.check(el, depth)
+    errorCount = checker.error_count
+    return ok
 
 
 def checkTree(tree):
     """
-    Process the XML tree.  There are two cases to be dealt with
-    1. This is a simple svg at the root - can be either the real namespace or
-       an empty namespace
-    2. This is an rfc tree - and we should only look for real namespaces, but
-       there may be more than one thing to look for.
+    Process the XML tree, writing diagnostics with the module level log
+    settings and leaving the number of errors in errorCount.  This is kept
+    for compatibility, see Checker.check_tree.
     """
     global errorCount
 
-    errorCount = 0
-    checkOK = True
-    element = tree.getroot().tag
-    if element[0] == "{":
-        element = element[element.rfind("}") + 1:]
-    if element == "svg":
-        checkOK = check(tree.getroot(), 0)
-    else:
-        # Locate all of the svg elements that we need to check
+    checker = Checker(logger=log.default)
+    ok = checker.check_tree(tree)
+    errorCount = checker.error_count
+    return ok
 
-        svgPaths = tree.getroot().xpath(
-            "//x:svg", namespaces={"x": "http://www.w3.org/2000/svg"}
-        )
 
-        for path in svgPaths:
-            if len(svgPaths) > 1:
-                log.note(
-                    "Checking svg element at line {0} in file {1}".format(1, "file")
-                )
-            checkOK = check(path, 0)
+def checkStream(events):
+    """
+    Check a document while it is being parsed, writing diagnostics with the
+    module level log settings.  See Checker.check_stream.
+    """
+    global errorCount
 
-    return errorCount == 0 and checkOK
+    checker = Checker(repair=False, logger=log.default)
+    ok = checker.check_stream(events)
+    errorCount = checker.error_count
+    return ok
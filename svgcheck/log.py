@@ -7,6 +7,10 @@
 
     If warn_error is set, then any warnings submitted will raise a
     python exception.
+
+    The module level functions write to write_err using the module level
+    quiet and verbose settings.  A Log instance carries its own stream and
+    settings, so a checker can write its diagnostics somewhere of its own.
 """
 
 import sys
@@ -20,40 +24,26 @@ debug = False
 write_err = sys.stderr
 
 
-def info(*args, **kwargs):
-    """ Prints a warning message unless quiet """
-    prefix = "INFO: "
-    if 'where' in kwargs:
-        where = kwargs['where']
-        fileName = where.base
-        if fileName.startswith("file:///"):
-            fileName = os.path.relpath(fileName[8:])
-        elif fileName[0:6] == 'file:/':
-            fileName = os.path.relpath(fileName[6:])
-        elif fileName[0:7] == 'http://' or fileName[0:8] == 'https://':
-            pass
-        else:
-            fileName = os.path.relpath(fileName)
-        prefix = "{0}:{1}: ".format(fileName, where.sourceline)
-    write_err.write(prefix + ' '.join(args))
-    write_err.write('\n')
-    write_err.flush()
+class Log(object):
+    """ A destination for diagnostics with its own quiet and verbose settings """
 
+    # Does diagnostic() do anything with what it is given?
+    structured = False
 
-def note(*args):
-    """ Call for being verbose only """
-    if verbose and not quiet:
-        write_err.write(' '.join(args))
-        write_err.write('\n')
+    # The number of diagnostics given to diagnostic() and exception()
+    count = 0
 
+    def __init__(self, write_err=None, quiet=False, verbose=False):
+        self.write_err = write_err if write_err is not None else sys.stderr
+        self.quiet = quiet
+        self.verbose = verbose
 
-def warn(*args, **kwargs):
-    """ Prints a warning message unless quiet """
-    if not quiet:
-        prefix = "WARNING: "
+    def info(self, *args, **kwargs):
+        """ Prints a warning message unless quiet """
+        prefix = "INFO: "
         if 'where' in kwargs:
             where = kwargs['where']
-            fileName = where.base
+            fileName = where.base or "<unknown>"
             if fileName.startswith("file:///"):
                 fileName = os.path.relpath(fileName[8:])
             elif fileName[0:6] == 'file:/':
@@ -63,48 +53,252 @@ def warn(*args, **kwargs):
             else:
                 fileName = os.path.relpath(fileName)
             prefix = "{0}:{1}: ".format(fileName, where.sourceline)
-        write_err.write(prefix + u' '.join(args))
-        write_err.write('\n')
-        write_err.flush()
+        self.write_err.write(prefix + ' '.join(args))
+        self.write_err.write('\n')
+        self.write_err.flush()
+
+    def is_verbose(self):
+        """ Returns True if note() will write anything.  Use it to guard work
+            which is only done to build a note, such as computing an indent.
+        """
+        return self.verbose and not self.quiet
+
+    def note(self, msg, *args):
+        """ Call for being verbose only
+
+            If args are given then msg is a % format string, which is only
+            expanded when the note is actually written.
+        """
+        if self.verbose and not self.quiet:
+            if args:
+                msg = msg % args
+            self.write_err.write(msg)
+            self.write_err.write('\n')
+
+    def warn(self, *args, **kwargs):
+        """ Prints a warning message unless quiet """
+        if not self.quiet:
+            prefix = "WARNING: "
+            if 'where' in kwargs:
+                where = kwargs['where']
+                fileName = where.base or "<unknown>"
+                if fileName.startswith("file:///"):
+                    fileName = os.path.relpath(fileName[8:])
+                elif fileName[0:6] == 'file:/':
+                    fileName = os.path.relpath(fileName[6:])
+                elif fileName[0:7] == 'http://' or fileName[0:8] == 'https://':
+                    pass
+                else:
+                    fileName = os.path.relpath(fileName)
+                prefix = "{0}:{1}: ".format(fileName, where.sourceline)
+            self.write_err.write(prefix + u' '.join(args))
+            self.write_err.write('\n')
+            self.write_err.flush()
+
+    def error(self, *args, **kwargs):
+        """ This is typically called after an exception was already raised. """
+        prefix = "ERROR: "
+        if 'where' in kwargs:
+            where = kwargs['where']
+            fileName = make_relative(where.base or "<unknown>")
+            prefix = "{0}:{1}: ".format(fileName, where.sourceline)
+        if 'file' in kwargs:
+            fileName = make_relative(kwargs['file'])
+            prefix = "{0}:{1}: ".format(fileName, kwargs['line'])
+        if 'additional' in kwargs:
+            prefix = ' ' * kwargs['additional']
+
+        self.write_err.write(prefix + ' '.join(args))
+        self.write_err.write('\n')
+        self.write_err.flush()
+
+    def diagnostic(self, record):
+        """ Take a diagnostic as a dict, see checksvg.Checker.report.  Its message
+            has been written already, so a Log writing text only counts it.
+        """
+        self.count += 1
+
+    def exception(self, message, list):
+        self.error(message)
+        if isinstance(list, Exception):
+            list = [list]
+        for e in list:
+            self.count += 1
+            attr = dict([(n, str(getattr(e, n)).replace("\n", " ")) for n in dir(e)
+                         if not n.startswith("_")])
+            if 'message' in attr:
+                if attr["message"].endswith(", got "):
+                    attr["message"] += "nothing."
+            else:
+                attr['message'] = '-- none --'
+            if 'filename' in attr:
+                attr["filename"] = make_relative(attr["filename"])
+            else:
+                attr['filename'] = 'unknown'
+            if 'line' not in attr:
+                attr['line'] = -1
+            self.write_err.write(" %(filename)s: Line %(line)s: %(message)s\n" % attr)
+
+
+class ModuleLog(Log):
+    """ The Log behind the module level functions, which uses the module level
+        settings so that changing log.quiet, log.verbose or log.write_err
+        takes effect straight away.
+    """
+
+    def __init__(self):
+        pass
+
+    @property
+    def write_err(self):
+        return write_err
+
+    @property
+    def quiet(self):
+        return quiet
+
+    @property
+    def verbose(self):
+        return verbose
+
+
+default = ModuleLog()
+
+
+class Where(object):
+    """ Stands in for an element as the where of a message """
+
+    def __init__(self, base, sourceline):
+        self.base = base
+        self.sourceline = sourceline
+
+
+class Recorder(Log):
+    """ A Log which keeps what is written to it so it can be replayed later.
+        The lines of messages are kept relative to first_line, so they can
+        be replayed for a copy of the same content which has moved.  Every
+        note is kept, whether or not the Log it is replayed to is verbose.
+    """
+
+    structured = True
+
+    def __init__(self, first_line):
+        Log.__init__(self, verbose=True)
+        self.first_line = first_line
+        self.records = []
+
+    def record(self, method, args, kwargs):
+        offset = None
+        if 'where' in kwargs:
+            offset = kwargs['where'].sourceline - self.first_line
+        self.records.append([method, list(args), offset])
+
+    def info(self, *args, **kwargs):
+        self.record('info', args, kwargs)
+
+    def note(self, msg, *args):
+        if args:
+            msg = msg % args
+        self.records.append(['note', [msg], None])
+
+    def warn(self, *args, **kwargs):
+        self.record('warn', args, kwargs)
+
+    def error(self, *args, **kwargs):
+        self.record('error', args, kwargs)
+
+    def diagnostic(self, record):
+        self.records.append(['diagnostic', [record], record['line'] - self.first_line])
+
+
+class Collector(Log):
+    """ A Log which keeps the structured diagnostics given to it in records,
+        and drops the text of the messages.  A document which can not be
+        parsed gets a parse-error diagnostic for each problem found.
+    """
+
+    structured = True
+
+    def __init__(self):
+        Log.__init__(self, io.StringIO(), quiet=True)
+        self.records = []
+
+    @property
+    def count(self):
+        return len(self.records)
+
+    def diagnostic(self, record):
+        self.records.append(record)
+
+    def exception(self, message, list):
+        if isinstance(list, Exception):
+            list = [list]
+        for e in list:
+            line = getattr(e, 'line', None)
+            if line is None and getattr(e, 'position', None):
+                line = e.position[0]
+            self.records.append({'rule': 'parse-error',
+                                 'severity': 'error',
+                                 'message': '{0}: {1}'.format(message, getattr(e, 'message', e)),
+                                 'file': make_relative(getattr(e, 'filename', None)
+                                                       or "<unknown>"),
+                                 'line': line,
+                                 'element': None,
+                                 'attribute': None,
+                                 'old': None,
+                                 'new': None,
+                                 'action': None})
+
+
+def replay(records, log, base, first_line):
+    """ Write the records of a Recorder to log, for content from line first_line of base """
+    for method, args, offset in records:
+        if method == 'note':
+            log.note(args[0])
+        elif method == 'diagnostic':
+            record = dict(args[0])
+            record['file'] = make_relative(base or "<unknown>")
+            record['line'] = first_line + offset
+            log.diagnostic(record)
+        elif offset is None:
+            getattr(log, method)(*args)
+        else:
+            getattr(log, method)(*args, where=Where(base, first_line + offset))
+
+
+def info(*args, **kwargs):
+    """ Prints a warning message unless quiet """
+    default.info(*args, **kwargs)
+
+
+def is_verbose():
+    """ Returns True if note() will write anything.  Use it to guard work
+        which is only done to build a note, such as computing an indent.
+    """
+    return verbose and not quiet
+
+
+def note(msg, *args):
+    """ Call for being verbose only
+
+        If args are given then msg is a % format string, which is only
+        expanded when the note is actually written.
+    """
+    default.note(msg, *args)
+
+
+def warn(*args, **kwargs):
+    """ Prints a warning message unless quiet """
+    default.warn(*args, **kwargs)
 
 
 def error(*args, **kwargs):
     """ This is typically called after an exception was already raised. """
-    prefix = "ERROR: "
-    if 'where' in kwargs:
-        where = kwargs['where']
-        fileName = make_relative(where.base)
-        prefix = "{0}:{1}: ".format(fileName, where.sourceline)
-    if 'file' in kwargs:
-        fileName = make_relative(kwargs['file'])
-        prefix = "{0}:{1}: ".format(fileName, kwargs['line'])
-    if 'additional' in kwargs:
-        prefix = ' ' * kwargs['additional']
-
-    write_err.write(prefix + ' '.join(args))
-    write_err.write('\n')
-    write_err.flush()
+    default.error(*args, **kwargs)
 
 
 def exception(message, list):
-    error(message)
-    if isinstance(list, Exception):
-        list = [list]
-    for e in list:
-        attr = dict([(n, str(getattr(e, n)).replace("\n", " ")) for n in dir(e)
-                     if not n.startswith("_")])
-        if 'message' in attr:
-            if attr["message"].endswith(", got "):
-                attr["message"] += "nothing."
-        else:
-            attr['message'] = '-- none --'
-        if 'filename' in attr:
-            attr["filename"] = make_relative(attr["filename"])
-        else:
-            attr['filename'] = 'unknown'
-        if 'line' not in attr:
-            attr['line'] = -1
-        write_err.write(" %(filename)s: Line %(line)s: %(message)s\n" % attr)
+    default.exception(message, list)
 
 
 def exception_lines(message, list):
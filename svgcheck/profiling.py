@@ -0,0 +1,93 @@
+"""
+Per-document profiles for svgcheck --profile.
+
+A Profile adds up the wall clock and CPU time spent in each phase of
+checking a document, and counts what the Checker did to each kind of
+element and attribute.
+"""
+
+import json
+import time
+import contextlib
+import collections
+
+
+class Profile(object):
+    """
+    Times and counts for one document.
+
+    phases         - phase name to [wall seconds, CPU seconds], in the order
+                     the phases were first entered
+    elements       - Counter of (element name, action)
+    attributes     - Counter of (attribute or style property name, action)
+    value_ok_calls - number of values checked
+
+    The actions are visited, removed, rewritten (the value was replaced) and
+    promoted (a style property was made an attribute).  A Checker which is
+    not repairing counts what it would have done.
+    """
+
+    actions = ('visited', 'removed', 'rewritten', 'promoted')
+
+    def __init__(self):
+        self.phases = collections.OrderedDict()
+        self.elements = collections.Counter()
+        self.attributes = collections.Counter()
+        self.value_ok_calls = 0
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """ Add the time taken by the body of the with statement to phase name """
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            times = self.phases.setdefault(name, [0.0, 0.0])
+            times[0] += time.perf_counter() - wall
+            times[1] += time.process_time() - cpu
+
+    def as_dict(self):
+        """ The profile as a dict of plain values, as written for --profile-format=json """
+        def by_name(counter):
+            names = collections.OrderedDict()
+            for (name, action), count in sorted(counter.items()):
+                names.setdefault(name, {})[action] = count
+            return names
+
+        return {'phases': collections.OrderedDict(
+                    (name, {'wall': wall, 'cpu': cpu})
+                    for name, (wall, cpu) in self.phases.items()),
+                'elements': by_name(self.elements),
+                'attributes': by_name(self.attributes),
+                'value_ok_calls': self.value_ok_calls}
+
+    def write(self, file, format='text', source=None):
+        """ Write the profile to file as text or json """
+        if format == 'json':
+            profile = self.as_dict()
+            profile['source'] = source
+            file.write(json.dumps(profile) + '\n')
+            return
+
+        file.write('Profile of {0}\n'.format(source))
+        file.write('  {0:<24} {1:>10} {2:>10}\n'.format('phase', 'wall', 'cpu'))
+        for name, (wall, cpu) in self.phases.items():
+            file.write('  {0:<24} {1:>9.4f}s {2:>9.4f}s\n'.format(name, wall, cpu))
+        file.write('  value_ok calls: {0}\n'.format(self.value_ok_calls))
+        for title, counter in (('element', self.elements), ('attribute', self.attributes)):
+            if not counter:
+                continue
+            file.write('  {0:<24}'.format(title) +
+                       ''.join(' {0:>10}'.format(action) for action in self.actions) + '\n')
+            for name in sorted(set(name for name, _ in counter)):
+                file.write('  {0:<24}'.format(name) +
+                           ''.join(' {0:>10}'.format(counter[name, action])
+                                   for action in self.actions) + '\n')
+        file.flush()
+
+
+def phase(profile, name):
+    """ profile.phase(name), or a with statement context doing nothing if profile is None """
+    if profile is None:
+        return contextlib.nullcontext()
+    return profile.phase(name)
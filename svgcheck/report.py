@@ -0,0 +1,96 @@
+"""
+Machine readable diagnostics for svgcheck --format.
+
+The result of checking each file is a dict of
+
+    file        - the file as named on the command line
+    ok          - True if it conforms
+    status      - the exit status for it
+    diagnostics - a list of the diagnostics, see checksvg.Checker.report
+
+A Reporter writes these out as one JSON document (json), as one line of
+JSON per file as soon as the file has been checked (ndjson), or as a SARIF
+2.1.0 log (sarif).
+"""
+
+import json
+import collections
+
+from svgcheck.__init__ import __version__
+
+formats = ('text', 'json', 'ndjson', 'sarif')
+
+# The rule ids of checksvg.Checker.report, with what they mean
+rules = collections.OrderedDict([
+    ('element-namespace', 'An element is in a namespace other than SVG'),
+    ('element-not-allowed', 'An element is not part of RFC 7996 SVG'),
+    ('child-not-allowed', 'An element is not allowed inside its parent'),
+    ('attribute-namespace', 'An attribute is in a namespace which is not allowed'),
+    ('attribute-not-allowed', 'An element does not allow an attribute'),
+    ('value-not-allowed', 'An attribute does not allow a value'),
+    ('style-malformed', 'A declaration in a style attribute is malformed'),
+    ('style-promoted', 'A style property was made an attribute'),
+    ('style-removed', 'A style property is not allowed'),
+    ('data-malformed', 'Path data or a points list is malformed, so only part of it is drawn'),
+    ('viewbox-missing', 'The root svg element has no viewBox'),
+    ('viewbox-size', 'The size of the svg element can not be worked out'),
+    ('parse-error', 'The document is not well formed XML'),
+    ('limit-exceeded', 'The document goes over a resource limit, so it was not checked'),
+    ('file-missing', 'A file to be checked does not exist'),
+])
+
+
+class Reporter(object):
+    """ Writes the results of checking files to file in format """
+
+    def __init__(self, format, file):
+        self.format = format
+        self.file = file
+        self.results = []
+
+    def add(self, result):
+        """ Take the result of checking a file """
+        if self.format == 'ndjson':
+            self.file.write(json.dumps(result) + '\n')
+            self.file.flush()
+        else:
+            self.results.append(result)
+
+    def close(self):
+        """ Write out what has been kept back until the end """
+        if self.format == 'json':
+            json.dump({'version': __version__, 'files': self.results}, self.file, indent=2)
+            self.file.write('\n')
+        elif self.format == 'sarif':
+            json.dump(sarif(self.results), self.file, indent=2)
+            self.file.write('\n')
+        self.file.flush()
+
+
+def sarif(results):
+    """ The results as a SARIF log """
+    found = []
+    for result in results:
+        for record in result['diagnostics']:
+            location = {'artifactLocation': {'uri': record['file'] or result['file']}}
+            if record['line'] is not None:
+                location['region'] = {'startLine': record['line']}
+            properties = dict((name, record[name])
+                              for name in ('element', 'attribute', 'old', 'new', 'action')
+                              if record[name] is not None)
+            found.append({'ruleId': record['rule'],
+                          'level': record['severity'],
+                          'message': {'text': record['message']},
+                          'locations': [{'physicalLocation': location}],
+                          'properties': properties})
+    driver = {'name': 'svgcheck',
+              'version': __version__,
+              'informationUri': 'https://github.com/ietf-tools/svgcheck',
+              'rules': [{'id': rule, 'shortDescription': {'text': text}}
+                        for rule, text in rules.items()]}
+    return {'$schema': 'https://json.schemastore.org/sarif-2.1.0.json',
+            'version': '2.1.0',
+            'runs': [{'tool': {'driver': driver},
+                      'artifacts': [{'location': {'uri': result['file']}}
+                                    for result in results],
+                      'results': found}]}
@@ -1,15 +1,34 @@
 import sys
 import optparse
 import os
+import io
+import copy
+import re
+import time
 import shutil
-import tempfile
+import fnmatch
 import lxml.etree
-from svgcheck.checksvg import checkTree
+from svgcheck.checksvg import Checker, Limits, LimitExceeded
+from svgcheck.profiling import Profile, phase
+from svgcheck.report import Reporter, formats
 from svgcheck.__init__ import __version__
 from svgcheck import log
-from xml2rfc.parser import XmlRfcParser, XmlRfcError
-from xml2rfc import CACHES, CACHE_PREFIX
-import svgcheck.word_properties as wp
+
+# xml2rfc takes far longer to import than the rest of svgcheck, and plain SVG
+# files never need it, so it is only imported for the documents that do.
+
+# Where the results of checking each file go for --format other than text
+reporter = None
+
+# The exit status for a document which goes over a resource limit
+limit_status = 3
+
+# Documents which use XInclude declare its namespace
+xinclude_url = b'http://www.w3.org/2001/XInclude'
+
+# The root element of the document, skipping the prolog.  A document type
+# declaration means entities, so that stops the match.
+root_re = re.compile(br'^(?:\xef\xbb\xbf)?(?:\s+|<\?.*?\?>|<!--.*?-->)*<([^\s/>!?]+)', re.S)
 
 
 def display_version(self, opt, value, parser):
@@ -17,7 +36,20 @@ def display_version(self, opt, value, parser):
     sys.exit()
 
 
+class HelpFormatter(optparse.IndentedHelpFormatter):
+    """ Fills in %caches in the help with the xml2rfc cache directories """
+
+    def expand_default(self, option):
+        help = optparse.IndentedHelpFormatter.expand_default(self, option)
+        if '%caches' in help:
+            from xml2rfc import CACHES
+            help = help.replace('%caches', ', '.join(CACHES))
+        return help
+
+
 def clear_cache(cache_path):
+    from xml2rfc import CACHES, CACHE_PREFIX
+
     # Explicit path given?
     paths = [os.path.expanduser(cache_path) for cache_path in CACHES]
     caches = cache_path and [cache_path] or paths
@@ -31,9 +63,9 @@ def clear_cache(cache_path):
 
 def main():
     # Populate the options
-    formatter = optparse.IndentedHelpFormatter(max_help_position=40)
-    optionparser = optparse.OptionParser(usage='svgcheck SOURCE [OPTIONS] '
-                                         '...\nExample: svgcheck draft.xml',
+    formatter = HelpFormatter(max_help_position=40)
+    optionparser = optparse.OptionParser(usage='svgcheck [OPTIONS] SOURCE ...'
+                                         '\nExample: svgcheck draft.xml',
                                          formatter=formatter)
 
     parser_options = optparse.OptionGroup(optionparser, 'Parser Options')
@@ -46,7 +78,18 @@ def main():
                               default=False, help='purge the cache and exit')
     parser_options.add_option('-c', '--cache', dest='cache',
                               help='specify a primary cache directory to write to;'
-                              'default: try [ %s ]' % ', '.join(CACHES))
+                              'default: try [ %caches ]')
+    parser_options.add_option('--cache-results', action='store_true', default=False,
+                              help='remember the results of checking documents in the cache,'
+                              ' and use them for documents which have not changed')
+    parser_options.add_option('--cache-max-size', type='int', default=100, metavar='MB',
+                              help='largest size of the result cache; default: 100')
+    parser_options.add_option('--cache-max-age', type='int', default=30, metavar='DAYS',
+                              help='remove cached results not used for DAYS; default: 30')
+    parser_options.add_option('--incremental', action='store_true', default=False,
+                              help='remember the results of checking each figure of an RFC'
+                              ' document in the cache, and only check the figures which'
+                              ' have changed')
 
     parser_options.add_option('-d', '--rng', dest='rng', help='specify an alternate RNG file')
     optionparser.add_option_group(parser_options)
@@ -58,10 +101,38 @@ def main():
                              help='specify an explicit output filename')
     other_options.add_option('-v', '--verbose', action='store_true',
                              help='print extra information')
+    other_options.add_option('--format', choices=formats, default='text',
+                             help='write the diagnostics to stdout as json, as ndjson with a'
+                             ' line for each file, or as sarif, rather than as text to stderr;'
+                             ' default: text')
     other_options.add_option('-V', '--version', action='callback', callback=display_version,
                              help='display the version number and exit')
+    other_options.add_option('-j', '--jobs', type='int', default=1, metavar='N',
+                             help='check up to N files in parallel, 0 means one per CPU;'
+                             ' default: 1')
+    other_options.add_option('--serve', metavar='ADDRESS',
+                             help='run as a checking service on ADDRESS, either [HOST:]PORT'
+                             ' or the path of a Unix socket')
+    other_options.add_option('--max-request-size', type='int', default=16 * 1024 * 1024,
+                             metavar='BYTES',
+                             help='largest document accepted by --serve; default: 16MiB')
     optionparser.add_option_group(other_options)
 
+    tree_options = optparse.OptionGroup(optionparser, 'Directory options')
+    tree_options.add_option('-R', '--recursive', metavar='DIR',
+                            help='check the .svg and .xml files in DIR and the directories in'
+                            ' it, then report a summary')
+    tree_options.add_option('--include', action='append', metavar='GLOB',
+                            help='with --recursive, only check files whose path in DIR matches'
+                            ' GLOB; may be repeated')
+    tree_options.add_option('--exclude', action='append', metavar='GLOB',
+                            help='with --recursive, skip files and directories whose path in'
+                            ' DIR matches GLOB; may be repeated')
+    tree_options.add_option('--out-dir', metavar='DIR',
+                            help='with --recursive, write repaired files to the same place in'
+                            ' DIR rather than to NAME.repaired.EXT next to each file')
+    optionparser.add_option_group(tree_options)
+
     svg_options = optparse.OptionGroup(optionparser, 'SVG options')
     svg_options.add_option('-r', '--repair', action='store_true', default=False,
                            help='Repair the SVG so it meets RFC 7966')
@@ -69,18 +140,74 @@ def main():
                            help='Emit the SVG file even if does not need repairing.  Implies -r')
     svg_options.add_option('-g', '--grey-scale', action='store_true',
                            help='Use grey scaling heuristic to determine what is white')
-    svg_options.add_option('--grey-level', default=381,
+    svg_options.add_option('--grey-level', type='int', default=381,
                            help='Level to use for grey scaling, defaults to 381')
+    svg_options.add_option('--check-only', action='store_true', default=False,
+                           help='Only report problems, never emit a repaired SVG')
+    svg_options.add_option('--fail-fast', action='store_true', default=False,
+                           help='Stop checking each document at the first problem which makes'
+                           ' it fail, and never repair it')
+    svg_options.add_option('--stream', action='store_true', default=False,
+                           help='Check the document as it is read without keeping all'
+                           ' of it in memory.  Requires --check-only or --fail-fast')
+    svg_options.add_option('--optimize', action='store_true', default=False,
+                           help='Check the syntax of path data and points lists, and write'
+                           ' them compactly in the repaired SVG')
+    svg_options.add_option('--precision', type='int', metavar='N',
+                           help='With --optimize, round the numbers in path data and points'
+                           ' lists to N decimal places')
     optionparser.add_option_group(svg_options)
 
+    limit_options = optparse.OptionGroup(optionparser, 'Limit options',
+                                         'Documents which go over a limit are not checked any'
+                                         ' further, and the exit status is 3.  There are no'
+                                         ' limits unless they are given.')
+    limit_options.add_option('--max-bytes', type='int', metavar='N',
+                             help='largest document, checked before it is read')
+    limit_options.add_option('--max-elements', type='int', metavar='N',
+                             help='most elements in a document, inside svg elements or not')
+    limit_options.add_option('--max-depth', type='int', metavar='N',
+                             help='deepest nesting of elements inside an svg element')
+    limit_options.add_option('--max-attribute-length', type='int', metavar='N',
+                             help='longest attribute value')
+    limit_options.add_option('--max-figures', type='int', metavar='N',
+                             help='most svg elements in an RFC document')
+    optionparser.add_option_group(limit_options)
+
+    profile_options = optparse.OptionGroup(optionparser, 'Profiling options')
+    profile_options.add_option('--profile', action='store_true', default=False,
+                               help='report the time taken by each phase of checking each'
+                               ' document, and what was done to each kind of element and'
+                               ' attribute')
+    profile_options.add_option('--profile-format', choices=['text', 'json'], default='text',
+                               metavar='FORMAT',
+                               help='write the --profile report as text or json; default: text')
+    profile_options.add_option('--profile-dump', metavar='FILE',
+                               help='run under cProfile and write the statistics to FILE,'
+                               ' which pstats can read')
+    optionparser.add_option_group(profile_options)
+
     # --- Parse and validate arguments --------------
 
     (options, args) = optionparser.parse_args()
+    apply_options(options)
 
-    # Setup warnings module
-    # rfclint.log.warn_error = options.warn_error and True or False
-    log.quiet = options.quiet and True or False
-    log.verbose = options.verbose
+    if options.check_only and (options.repair or options.always_emit):
+        optionparser.error('--check-only can not be used with --repair or --always-emit')
+    if options.fail_fast and (options.repair or options.always_emit):
+        optionparser.error('--fail-fast can not be used with --repair or --always-emit')
+    if options.stream and not (options.check_only or options.fail_fast):
+        optionparser.error('--stream can only be used with --check-only or --fail-fast')
+    if options.precision is not None and not options.optimize:
+        optionparser.error('--precision can only be used with --optimize')
+    if options.precision is not None and options.precision < 0:
+        optionparser.error('--precision must not be negative')
+    if options.jobs < 0:
+        optionparser.error('--jobs must not be negative')
+
+    if (options.format != 'text' and (options.repair or options.always_emit) and
+            options.output_filename is None and not options.recursive):
+        optionparser.error('--format needs --out when repairing, stdout holds the diagnostics')
 
     if options.no_xinclude:
         log.warn('--no-xinclude option is deprecated and has no effect.')
@@ -104,71 +231,625 @@ def main():
     if options.clear_cache:
         clear_cache(options.cache)
 
-    if options.grey_scale:
-        wp.color_threshold = options.grey_level
+    options.result_cache = None
+    options.figure_cache = None
+    if options.cache_results or options.incremental:
+        from svgcheck import cache
+        directory = cache.cache_directory(options.cache)
+        max_size = options.cache_max_size * 1024 * 1024
+        max_age = options.cache_max_age * 24 * 60 * 60
+        if directory is None:
+            log.warn('No writable cache directory, results will not be cached')
+        else:
+            if options.cache_results:
+                options.result_cache = cache.ResultCache(directory, max_size, max_age)
+            if options.incremental:
+                figures = os.path.join(directory, 'figures')
+                os.makedirs(figures, exist_ok=True)
+                options.figure_cache = cache.ResultCache(figures, max_size, max_age)
 
-    if len(args) < 1:
-        source = None
-        try:
-            with tempfile.NamedTemporaryFile(mode="w+b", delete=False) as tmp_file:
-                data = sys.stdin.buffer.read()
-                tmp_file.write(data)
-                tmp_file.close()
-                source = tmp_file.name
-                process_svg(options, source)
-        finally:
-            if source and os.path.exists(source):
-                os.remove(source)
-    else:
+    if options.serve:
+        from svgcheck import serve
+        sys.exit(serve.serve(options))
+
+    global reporter
+    if options.format != 'text':
+        reporter = Reporter(options.format, sys.stdout)
+
+    profiler = None
+    if options.profile_dump:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    if options.recursive:
+        if args or options.output_filename is not None:
+            optionparser.error('--recursive cannot be used with SOURCE or --out')
+        if not os.path.isdir(options.recursive):
+            sys.exit('No such directory: ' + options.recursive)
+        status = process_tree(options, options.recursive)
+    elif len(args) < 1:
+        if options.max_bytes is not None:
+            # Enough to tell that it is too large, without reading all of it
+            data = sys.stdin.buffer.read(options.max_bytes + 1)
+        else:
+            data = sys.stdin.buffer.read()
+        status = process_svg(options, '<stdin>', data=data)
+    elif len(args) == 1:
         source = args[0]
         if not os.path.exists(source):
-            sys.exit('No such file: ' + source)
-        process_svg(options, source)
+            if reporter is None:
+                sys.exit('No such file: ' + source)
+            status = report_missing(source)
+        else:
+            status = process_svg(options, source)
+    else:
+        if options.output_filename is not None:
+            optionparser.error('--out cannot be used with more than one SOURCE')
+        if options.repair or options.always_emit:
+            optionparser.error('--repair and --always-emit cannot be used with more than one '
+                               'SOURCE, use --recursive to repair a tree')
+        status = process_batch(options, args)
 
+    if reporter is not None:
+        reporter.close()
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(options.profile_dump)
+    for results in (options.result_cache, options.figure_cache):
+        if results is not None:
+            results.evict()
+    sys.exit(status)
 
-def process_svg(options, source):
+
+def apply_options(options):
+    """ Set the module level log settings from the options """
     # Setup warnings module
     # rfclint.log.warn_error = options.warn_error and True or False
     log.quiet = options.quiet and True or False
     log.verbose = options.verbose
 
-    # Parse the document into an xmlrfc tree instance
-    parser = XmlRfcParser(source, verbose=options.verbose,
-                          quiet=options.quiet,
-                          cache_path=options.cache,
-                          no_network=options.no_network)
+
+def make_checker(options, repair=True, profile=None, logger=None):
+    """ Make a Checker from the options, writing to logger or the module level log """
+    threshold = options.grey_level if options.grey_scale else None
+    return Checker(color_threshold=threshold, repair=repair, logger=logger or log.default,
+                   profile=profile, figures=options.figure_cache, fail_fast=options.fail_fast,
+                   limits=make_limits(options), optimize=options.optimize,
+                   precision=options.precision)
+
+
+def make_limits(options):
+    """ The checksvg.Limits given by the options, or None if there are none """
+    limits = Limits(options.max_bytes, options.max_elements, options.max_depth,
+                    options.max_attribute_length, options.max_figures)
+    if all(limit is None for limit in limits):
+        return None
+    return limits
+
+
+def make_logger(options):
+    """ The Log to check a file with: a log.Collector for --format, otherwise the module log """
+    return log.Collector() if options.format != 'text' else log.default
+
+
+def write_diagnostics(err, results):
+    """
+    Write what was captured from checking a file: the text written to
+    stderr, and the results for the reporter if there is one
+    """
+    if reporter is not None:
+        for result in results:
+            reporter.add(result)
+    log.write_err.write(err)
+    log.write_err.flush()
+
+
+def process_batch(options, sources):
+    """
+    Check a list of files, fanning them out over a pool of worker processes.
+    The diagnostics and output of each file are written in the order the files
+    were given.  Returns 0 if every file conforms and 1 otherwise.
+    """
+    jobs = options.jobs or os.cpu_count() or 1
+    status = 0
+    if jobs == 1:
+        for source in sources:
+            if not os.path.exists(source):
+                status = max(status, report_missing(source, name=source))
+                continue
+            status = max(status, process_svg(options, source, name=source))
+        return status
+
+    import concurrent.futures
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(jobs, len(sources)),
+                                                initializer=apply_options,
+                                                initargs=(options,)) as executor:
+        results = executor.map(capture_svg, [options] * len(sources), sources, sources)
+        for result, err, out, found, _ in results:
+            write_diagnostics(err, found)
+            sys.stdout.write(out)
+            sys.stdout.flush()
+            status = max(status, result)
+    return status
+
+
+def find_sources(top, includes=None, excludes=None):
+    """
+    The .svg and .xml files in the directory top and those under it, as a
+    sorted list of (path, path relative to top).  If includes is given, only
+    files whose relative path matches one of its globs are found, and files
+    and directories matching one of the excludes globs are skipped.  As with
+    fnmatch, * in a glob matches / too.  Files
+    written by an earlier --recursive --repair, NAME.repaired.EXT, are skipped
+    too.
+    """
+    def matches(path, globs):
+        return any(fnmatch.fnmatch(path, glob) for glob in globs or ())
+
+    found = []
+    for dir, dirs, files in os.walk(top):
+        dirs[:] = [d for d in sorted(dirs)
+                   if not matches(os.path.relpath(os.path.join(dir, d), top), excludes)]
+        for file in sorted(files):
+            root, ext = os.path.splitext(file)
+            if ext.lower() not in ('.svg', '.xml') or root.endswith('.repaired'):
+                continue
+            path = os.path.join(dir, file)
+            relative = os.path.relpath(path, top)
+            if includes and not matches(relative, includes):
+                continue
+            if matches(relative, excludes):
+                continue
+            found.append((path, relative))
+    return found
+
+
+def repaired_path(options, source, relative):
+    """ Where --recursive writes the repaired copy of source """
+    if options.out_dir is not None:
+        return os.path.join(options.out_dir, relative)
+    root, ext = os.path.splitext(source)
+    return root + '.repaired' + ext
+
+
+def check_in_tree(options, source, output):
+    """
+    Check one file for --recursive, writing the repaired document to output.
+    Returns the exit status, the text written to stderr, the results for the
+    reporter, the number of diagnostics and the time taken.
+    """
+    start = time.perf_counter()
+    options = copy.copy(options)
+    options.output_filename = output
+    if options.repair or options.always_emit:
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    status, err, _, results, count = capture_svg(options, source, name=source)
+    return status, err, results, count, time.perf_counter() - start
+
+
+def process_tree(options, top):
+    """
+    Check the files found in the directory top, in parallel if -j is given.
+    The diagnostics of each file are written as soon as it and the files
+    before it have been checked, followed by a summary.  Returns 0 if every
+    file conforms and 1 otherwise.
+    """
+    sources = find_sources(top, options.include, options.exclude)
+    outputs = [repaired_path(options, path, relative) for path, relative in sources]
+    paths = [path for path, _ in sources]
+    jobs = options.jobs or os.cpu_count() or 1
+
+    summary = []
+    executor = None
+    if jobs == 1 or len(paths) < 2:
+        results = map(check_in_tree, [options] * len(paths), paths, outputs)
+    else:
+        import concurrent.futures
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=min(jobs, len(paths)),
+                                                          initializer=apply_options,
+                                                          initargs=(options,))
+        results = executor.map(check_in_tree, [options] * len(paths), paths, outputs)
+    try:
+        for source, (status, err, found, count, elapsed) in zip(paths, results):
+            write_diagnostics(err, found)
+            summary.append((source, status, count, elapsed))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    write_summary(summary)
+    return max([status for _, status, _, _ in summary] + [0])
+
+
+def write_summary(summary, slowest=5):
+    """
+    Write a table of how many files were checked, how many conform, the
+    number of diagnostics and the slowest files.  summary holds (source,
+    status, diagnostics, seconds) for each file.
+    """
+    if log.quiet:
+        return
+    failed = sum(1 for _, status, _, _ in summary if status != 0)
+    write = log.write_err.write
+    write('\n')
+    write('  {0:<14} {1:>8}\n'.format('files', len(summary)))
+    write('  {0:<14} {1:>8}\n'.format('conform', len(summary) - failed))
+    write('  {0:<14} {1:>8}\n'.format('do not conform', failed))
+    write('  {0:<14} {1:>8}\n'.format('diagnostics', sum(count for _, _, count, _ in summary)))
+    if summary:
+        write('  slowest files:\n')
+        for source, _, _, elapsed in sorted(summary, key=lambda file: -file[3])[:slowest]:
+            write('    {0:>9.4f}s  {1}\n'.format(elapsed, source))
+    log.write_err.flush()
+
+
+def capture_svg(options, source, name=None, data=None):
+    """
+    Run process_svg capturing what it writes, as is done in pool workers.
+    Returns the exit status, the text written to stderr, the repaired
+    document, for --format the results for the reporter, and the number of
+    diagnostics.  The results are kept apart from the text, which may hold
+    notes or a --profile report.
+    """
+    global reporter
+    err = io.StringIO()
+    out = io.BytesIO()
+    saved = log.write_err, log.default, reporter
+    log.write_err = err
+    # A module log of its own, to count the diagnostics written as text
+    log.default = log.ModuleLog()
+    # A reporter which keeps the results rather than writing them
+    captured = Reporter('json', None) if options.format != 'text' else None
+    reporter = captured
+    try:
+        if data is None and not os.path.exists(source):
+            status = report_missing(source, name)
+        else:
+            status = process_svg(options, source, name=name, out=out, data=data)
+        if captured is not None:
+            count = sum(len(result['diagnostics']) for result in captured.results)
+        else:
+            count = log.default.count
+    finally:
+        log.write_err, log.default, reporter = saved
+    results = captured.results if captured is not None else []
+    return status, err.getvalue(), out.getvalue().decode('utf-8'), results, count
+
+
+def needs_xml2rfc(data):
+    """
+    Does the document need xml2rfc's parser?  RFC documents do, as do
+    documents with a document type declaration or which use XInclude.  Plain
+    SVG can be read with lxml alone.
+    """
+    match = root_re.match(data)
+    if match is None or match.group(1).split(b':')[-1] != b'svg':
+        return True
+    return xinclude_url in data
+
+
+def self_contained(data):
+    """
+    Does the document stand on its own, so the result of checking it
+    depends only on its bytes?  Not if it has a document type declaration,
+    which may load entities, or uses XInclude.
+    """
+    return root_re.match(data) is not None and xinclude_url not in data
+
+
+def file_key(results, options, source, name=None, size=65536):
+    """
+    The result cache key for the file source, read in chunks of size bytes
+    so the whole of it is never held in memory, or None if it does not stand
+    on its own, see self_contained.  The prolog and root element have to be
+    in the first chunk.
+    """
+    found = []
+
+    def chunks(file):
+        tail = b''
+        for chunk in iter(lambda: file.read(size), b''):
+            # The URL may be split between two chunks
+            if xinclude_url in tail + chunk[:len(xinclude_url)] or xinclude_url in chunk:
+                found.append(True)
+            tail = chunk[-len(xinclude_url):]
+            yield chunk
+
+    with open(source, 'rb') as f:
+        head = f.read(size)
+        if root_re.match(head) is None:
+            return None
+        f.seek(0)
+        key = results.key(chunks(f), options, source, name)
+    return None if found else key
+
+
+def parse_data(options, data, source, path=None, logger=None):
+    """
+    Parse a document held in memory.  source is used as the base URL so the
+    diagnostics can name it, and path is the file it was read from if any.
+
+    Plain SVG is parsed with lxml alone.  Anything else goes to xml2rfc,
+    through XmlRfcParser if the document is a file, and otherwise with a
+    parser set up the way XmlRfcParser sets up its own.
+
+    Returns an lxml ElementTree, or None if the document could not be
+    parsed and the reason has been logged to logger or the module log.
+    """
+    logger = logger or log.default
     try:
-        xmlrfc = parser.parse(remove_pis=True, remove_comments=False,
-                              strip_cdata=False)
-    except XmlRfcError as e:
-        log.exception('Unable to parse the XML document: ' + source, e)
-        sys.exit(1)
+        if not needs_xml2rfc(data):
+            # Without entities, huge_tree only lifts the limits on depth and
+            # text size, which --max-depth and --max-bytes can bound instead
+            parser = lxml.etree.XMLParser(dtd_validation=False,
+                                          load_dtd=False,
+                                          no_network=True,
+                                          remove_comments=False,
+                                          remove_pis=True,
+                                          remove_blank_text=False,
+                                          resolve_entities=False,
+                                          strip_cdata=False,
+                                          huge_tree=True)
+            return lxml.etree.fromstring(data, parser, base_url=source).getroottree()
+
+        from xml2rfc.parser import XmlRfcParser, XmlRfcError
+        try:
+            if path is not None:
+                # Parse the document into an xmlrfc tree instance
+                parser = XmlRfcParser(path, verbose=options.verbose,
+                                      quiet=options.quiet,
+                                      cache_path=options.cache,
+                                      no_network=options.no_network)
+                return parser.parse(remove_pis=True, remove_comments=False,
+                                    strip_cdata=False).tree
+
+            parser = lxml.etree.XMLParser(dtd_validation=False,
+                                          load_dtd=True,
+                                          attribute_defaults=True,
+                                          no_network=options.no_network,
+                                          remove_comments=False,
+                                          remove_pis=True,
+                                          remove_blank_text=False,
+                                          resolve_entities=True,
+                                          strip_cdata=False)
+            parser.resolvers.add(make_resolver(options))
+            return lxml.etree.fromstring(data, parser, base_url=source).getroottree()
+        except XmlRfcError as e:
+            logger.exception('Unable to parse the XML document: ' + source, e)
+            return None
     except lxml.etree.XMLSyntaxError as e:
         # Give the lxml.etree.XmlSyntaxError exception a line attribute which
         # matches lxml.etree._LogEntry, so we can use the same logging function
-        log.exception('Unable to parse the XML document: ' + source, e.error_log)
-        sys.exit(1)
+        logger.exception('Unable to parse the XML document: ' + source, e.error_log)
+        return None
+
+
+def make_resolver(options):
+    """ Returns the xml2rfc resolver used for entities and DTDs """
+    from xml2rfc.parser import XmlRfcParser
+
+    return XmlRfcParser(None, verbose=options.verbose,
+                        quiet=options.quiet,
+                        cache_path=options.cache,
+                        no_network=options.no_network).cachingResolver
+
+
+def stream_svg(options, source, name=None, data=None):
+    """
+    Check a single file while it is being parsed, see Checker.check_stream.
+    Nothing is repaired so there is no output.  Returns the exit status.
+    """
+    profile = Profile() if options.profile else None
+    logger = make_logger(options)
+    checker = make_checker(options, repair=False, profile=profile, logger=logger)
+    try:
+        checker.prescan(size=len(data) if data is not None else os.path.getsize(source),
+                        source=source)
+    except LimitExceeded:
+        return report_limit(source, name, logger)
+    if data is not None:
+        source_file = io.BytesIO(data)
+        source_file.name = source
+        head = data[:65536]
+    else:
+        source_file = source
+        with phase(profile, 'read'):
+            with open(source, 'rb') as f:
+                head = f.read(65536)
+    plain = not needs_xml2rfc(head)
+    context = lxml.etree.iterparse(source_file,
+                                   events=("start", "end"),
+                                   dtd_validation=False,
+                                   load_dtd=True,
+                                   attribute_defaults=True,
+                                   no_network=options.no_network,
+                                   remove_comments=False,
+                                   remove_pis=True,
+                                   remove_blank_text=False,
+                                   resolve_entities=True,
+                                   strip_cdata=False,
+                                   huge_tree=plain)
+    if not plain:
+        context.resolvers.add(make_resolver(options))
+    try:
+        with phase(profile, 'parse and check'):
+            ok = checker.check_stream(context)
+    except LimitExceeded:
+        return report_limit(source, name, logger)
+    except lxml.etree.XMLSyntaxError as e:
+        logger.exception('Unable to parse the XML document: ' + source, e.error_log)
+        return report_result(False, source, name, logger) if logger.structured else 1
+    status = report_result(ok, source, name, logger)
+    if profile is not None:
+        profile.write(log.write_err, options.profile_format, source)
+    return status
 
-    # Check that
 
-    ok = checkTree(xmlrfc.tree)
+def process_svg(options, source, name=None, out=None, data=None):
+    """
+    Parse and check a single file, writing the repaired document if asked to.
+    If data is given it holds the document and source is only used to name it.
+    When name is given it is included in the final verdict.  The repaired
+    document goes to the -o file, to the binary file out if given, or to
+    stdout.  Returns the exit status for the file: 0 if it conforms, 1 if
+    it does not and limit_status if it goes over a resource limit.
+    """
+    if options.result_cache is not None and not (options.profile or options.stream):
+        return cached_svg(options, source, name, out, data)
+    if options.stream:
+        return stream_svg(options, source, name, data)
+
+    profile = Profile() if options.profile else None
+    logger = make_logger(options)
+    checker = make_checker(options, repair=options.repair or options.always_emit,
+                           profile=profile, logger=logger)
+    path = None
+    try:
+        if data is None:
+            checker.prescan(size=os.path.getsize(source), source=source)
+            with phase(profile, 'read'):
+                with open(source, 'rb') as f:
+                    data = f.read()
+            path = source
+        checker.prescan(data, source=source)
+        with phase(profile, 'parse'):
+            tree = parse_data(options, data, source, path=path, logger=logger)
+        if tree is None:
+            return report_result(False, source, name, logger) if logger.structured else 1
+
+        # Check that
+
+        with phase(profile, 'check'):
+            ok = checker.check_tree(tree)
+    except LimitExceeded:
+        return report_limit(source, name, logger)
     if (not ok and options.repair) or options.always_emit:
-        encodedBytes = lxml.etree.tostring(xmlrfc.tree.getroot(),
-                                           xml_declaration=True,
-                                           encoding='utf-8',
-                                           pretty_print=True).decode('utf-8')
-        if options.output_filename is None:
-            file = sys.stdout
+        with phase(profile, 'serialize'):
+            if options.output_filename is not None:
+                with open(options.output_filename, 'wb') as file:
+                    write_tree(tree, file)
+            elif out is not None:
+                write_tree(tree, out)
+            else:
+                sys.stdout.flush()
+                write_tree(tree, sys.stdout.buffer)
+                sys.stdout.buffer.flush()
+
+    status = report_result(ok, source, name, logger)
+    if profile is not None:
+        profile.write(log.write_err, options.profile_format, source)
+    return status
+
+
+def write_tree(tree, file):
+    """
+    Write the document to the binary file as UTF-8 with an XML declaration,
+    pretty printed.  The document is serialized as it is written, so the
+    whole of it is never held as a string.
+    """
+    with lxml.etree.xmlfile(file, encoding='utf-8') as xf:
+        xf.write_declaration()
+        xf.write(tree.getroot(), pretty_print=True)
+
+
+def cached_svg(options, source, name=None, out=None, data=None):
+    """
+    process_svg through the result cache: an unchanged document checked
+    with the same options gets the diagnostics, output and exit status it
+    got last time.  Documents which may refer to other files are always
+    checked, as are those over --max-bytes, which are not read.
+    """
+    uncached = copy.copy(options)
+    uncached.result_cache = None
+    results = options.result_cache
+    if data is not None:
+        key = results.key([data], options, source, name) if self_contained(data) else None
+    elif options.max_bytes is not None and os.path.getsize(source) > options.max_bytes:
+        key = None
+    else:
+        key = file_key(results, options, source, name)
+    if key is None:
+        return process_svg(uncached, source, name, out, data)
+
+    entry = results.get(key)
+    if entry is None or 'count' not in entry:
+        uncached.output_filename = None
+        status, err, output, found, count = capture_svg(uncached, source, name, data)
+        entry = {'status': status, 'diagnostics': err, 'output': output, 'results': found,
+                 'count': count}
+        results.put(key, entry)
+    else:
+        log.note('Using the cached result for %s', source)
+    log.default.count += entry['count']
+
+    write_diagnostics(entry['diagnostics'], entry['results'])
+    if entry['output']:
+        output = entry['output'].encode('utf-8')
+        if options.output_filename is not None:
+            with open(options.output_filename, 'wb') as file:
+                file.write(output)
+        elif out is not None:
+            out.write(output)
         else:
-            file = open(options.output_filename, 'w', encoding='utf-8')
-        file.write(encodedBytes)
+            sys.stdout.flush()
+            sys.stdout.buffer.write(output)
+            sys.stdout.buffer.flush()
+    return entry['status']
+
+
+def report_result(ok, source, name=None, logger=log.default):
+    """
+    Give the result of checking a file: its verdict, or everything collected
+    by logger if that is a log.Collector.  Returns the exit status.
+    """
+    if not logger.structured:
+        return report_verdict(ok, name)
+    status = 0 if ok else 1
+    reporter.add({'file': name or source, 'ok': ok, 'status': status,
+                  'diagnostics': logger.records})
+    return status
+
+
+def report_missing(source, name=None):
+    """ Give the result for a file which does not exist.  Returns the exit status, 1. """
+    message = 'No such file: ' + source
+    if reporter is None:
+        log.write_err.write(message + '\n')
+        log.write_err.flush()
+    else:
+        reporter.add({'file': name or source, 'ok': False, 'status': 1,
+                      'diagnostics': [{'rule': 'file-missing', 'severity': 'error',
+                                       'message': message, 'file': source, 'line': None,
+                                       'element': None, 'attribute': None, 'old': None,
+                                       'new': None, 'action': None}]})
+    return 1
+
+
+def report_limit(source, name=None, logger=log.default):
+    """
+    Give the result of checking a file which went over a resource limit, which
+    has been reported already.  Returns the exit status, limit_status.
+    """
+    if logger.structured:
+        reporter.add({'file': name or source, 'ok': False, 'status': limit_status,
+                      'diagnostics': logger.records})
+    else:
+        prefix = name + ': ' if name else ''
+        log.error(prefix + "File goes over a resource limit and was not checked")
+    return limit_status
+
 
+def report_verdict(ok, name=None):
+    """ Log whether the document conforms and return the matching exit status """
+    prefix = name + ': ' if name else ''
     if ok:
-        log.info("File conforms to SVG requirements.")
-        sys.exit(0)
+        log.info(prefix + "File conforms to SVG requirements.")
+        return 0
 
-    log.error("File does not conform to SVG requirements")
-    sys.exit(1)
+    log.error(prefix + "File does not conform to SVG requirements")
+    return 1
 
 
 if __name__ == '__main__':
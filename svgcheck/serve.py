@@ -0,0 +1,159 @@
+"""
+A long running checker for svgcheck --serve.
+
+The rule tables, lxml and xml2rfc are loaded once, and documents are
+checked by a pool of worker processes which stay up between requests.
+Requests are made over HTTP, either on a localhost port or on a Unix
+socket.
+
+POST the SVG or RFC XML document as the request body.  The query string
+may hold repair=1 to get the repaired document back, and name=NAME to
+give the document a name for the diagnostics.  The reply is a JSON object
+
+    {"ok": true, "status": 0, "diagnostics": [...], "output": null}
+
+where output holds the repaired document when one was asked for and
+needed.
+"""
+
+import os
+import copy
+import stat
+import json
+import signal
+import socketserver
+import http.server
+import urllib.parse
+import concurrent.futures
+
+from svgcheck import log
+from svgcheck.__init__ import __version__
+from svgcheck.run import apply_options, capture_svg
+
+
+class CheckHandler(http.server.BaseHTTPRequestHandler):
+    """ Check the document in the body of each POST request """
+
+    server_version = 'svgcheck/' + __version__
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = self.headers.get('Content-Length')
+        try:
+            length = int(length)
+        except (TypeError, ValueError):
+            self.send_error(411, 'A Content-Length is required')
+            return
+        if length < 0 or length > self.server.max_request_size:
+            self.close_connection = True
+            self.send_error(413, 'Documents are limited to %d bytes' %
+                            self.server.max_request_size)
+            return
+        data = self.rfile.read(length)
+
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        repair = query.get('repair', ['0'])[0].lower() in ('1', 'yes', 'true')
+        name = query.get('name', ['<request>'])[0]
+
+        options = copy.copy(self.server.options)
+        options.repair = repair
+        options.always_emit = False
+        options.check_only = not repair
+        options.fail_fast = options.fail_fast and not repair
+        options.stream = options.stream and not repair
+        options.output_filename = None
+        options.format = 'text'
+
+        status, err, out, _, _ = self.server.executor.submit(capture_svg, options, name,
+                                                             None, data).result()
+        self.send_json({'ok': status == 0,
+                        'status': status,
+                        'diagnostics': err.splitlines(),
+                        'output': out or None})
+
+    def send_json(self, reply):
+        body = json.dumps(reply).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        log.note('%s - ' + format, self.address_string(), *args)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ An HTTP server on a Unix socket, handling each request in a thread """
+
+    daemon_threads = True
+
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+def parse_address(address):
+    """
+    An address containing a path separator is a Unix socket, anything else is
+    [HOST:]PORT with the host defaulting to 127.0.0.1.  Returns the server
+    class and the address to give it.
+    """
+    if '/' in address or os.sep in address:
+        return ThreadingUnixHTTPServer, address
+    host, _, port = address.rpartition(':')
+    return http.server.ThreadingHTTPServer, (host or '127.0.0.1', int(port))
+
+
+def init_worker(options):
+    """ Set up a worker process, leaving interrupts to the server """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    apply_options(options)
+
+
+def interrupt(signum, frame):
+    """ Treat a request to terminate as an interrupt, so the workers are shut down """
+    raise KeyboardInterrupt()
+
+
+def serve(options):
+    """ Answer check requests until interrupted.  Returns the exit status. """
+    try:
+        server_class, address = parse_address(options.serve)
+    except ValueError:
+        log.error('Not an address to serve on: ' + options.serve)
+        return 1
+    if server_class is ThreadingUnixHTTPServer and os.path.lexists(address):
+        # Only a socket left by an earlier server is removed, never a file
+        if not stat.S_ISSOCK(os.lstat(address).st_mode):
+            log.error('Not a socket, not replacing it: ' + address)
+            return 1
+        os.remove(address)
+
+    jobs = options.jobs or os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs,
+                                                initializer=init_worker,
+                                                initargs=(options,)) as executor:
+        with server_class(address, CheckHandler) as server:
+            server.options = options
+            server.executor = executor
+            server.max_request_size = options.max_request_size
+            if isinstance(server.server_address, tuple):
+                where = 'http://%s:%d/' % server.server_address[:2]
+            else:
+                where = server.server_address
+            log.info('svgcheck serving on', where)
+            signal.signal(signal.SIGTERM, interrupt)
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                if server_class is ThreadingUnixHTTPServer:
+                    os.remove(address)
+    return 0
@@ -7,9 +7,19 @@ import subprocess
 import sys
 from xml2rfc.parser import XmlRfcParser
 import difflib
+import http.client
+import json
+import threading
+import time
 from svgcheck.checksvg import checkTree
+from svgcheck import checksvg
 from svgcheck import log
+from svgcheck import bench
+import svgcheck.word_properties as wp
 import io
+import contextlib
+import asyncio
+import concurrent.futures
 
 test_program = "svgcheck"
 
@@ -34,13 +44,16 @@ class Test_Coding(unittest.TestCase):
     def test_pycodestyle_conformance(self):
         """Test that we conform to PEP8."""
         pep8style = pycodestyle.StyleGuide(quiet=False, config_file="pycode.cfg")
-        result = pep8style.check_files(['run.py', 'checksvg.py', 'test.py', 'word_properties.py'])
+        result = pep8style.check_files(['run.py', 'checksvg.py', 'test.py', 'word_properties.py',
+                                        'serve.py', 'cache.py', 'bench.py', 'profiling.py',
+                                        'aio.py', 'report.py'])
         self.assertEqual(result.total_errors, 0,
                          "Found code style errors (and warnings).")
 
     def test_pyflakes_confrmance(self):
         p = subprocess.Popen(['pyflakes', 'run.py', 'checksvg.py', 'test.py',
-                              'word_properties.py'],
+                              'word_properties.py', 'serve.py', 'cache.py', 'bench.py',
+                              'profiling.py', 'aio.py', 'report.py'],
                              stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         (stdoutX, stderrX) = p.communicate()
         ret = p.wait()
@@ -67,6 +80,147 @@ class TestCommandLineOptions(unittest.TestCase):
                       None, None)
         self.assertFalse(os.path.exists('Temp/cache/reference.RFC.1847.xml'))
 
+    def test_recursive(self):
+        tree = 'Temp/tree'
+        if os.path.exists(tree):
+            shutil.rmtree(tree)
+        os.makedirs(tree + '/a/b')
+        os.makedirs(tree + '/skip')
+        shutil.copy('Tests/colors.svg', tree + '/a/colors.svg')
+        shutil.copy('Tests/good.svg', tree + '/a/b/good.svg')
+        shutil.copy('Tests/good.svg', tree + '/skip/good.svg')
+        shutil.copy('Tests/good.svg', tree + '/notes.txt')
+
+        args = [sys.executable, test_program, "--recursive", tree, "--exclude", "skip",
+                "--repair"]
+        p = subprocess.run(args + ["--jobs=2", "--out-dir=" + tree + "-out"],
+                           capture_output=True)
+        self.assertEqual(p.returncode, 1)
+        err = p.stderr.decode('utf-8')
+        self.assertIn("ERROR: Temp/tree/a/colors.svg: File does not conform", err)
+        self.assertIn("INFO: Temp/tree/a/b/good.svg: File conforms", err)
+        self.assertNotIn("skip", err)
+        self.assertRegex(err, r"files +2\n +conform +1\n +do not conform +1\n"
+                              r" +diagnostics +12\n +slowest files:\n")
+        self.assertTrue(os.path.exists(tree + '-out/a/colors.svg'))
+        self.assertFalse(os.path.exists(tree + '-out/a/b/good.svg'))
+
+        # Notes are not diagnostics
+        p = subprocess.run(args + ["--verbose", "--out-dir=" + tree + "-out"],
+                           capture_output=True)
+        self.assertRegex(p.stderr.decode('utf-8'), r"\n +diagnostics +12\n")
+
+        # Without --out-dir the repaired file is put next to the original,
+        # and is not checked by later runs
+        for _ in range(2):
+            p = subprocess.run(args + ["--include", "*/colors*"], capture_output=True)
+            self.assertIn(b"files                 1\n", p.stderr)
+        self.assertTrue(os.path.exists(tree + '/a/colors.repaired.svg'))
+
+    def test_format(self):
+        def run(format, *args):
+            p = subprocess.run([sys.executable, test_program, "--format", format] + list(args),
+                               capture_output=True)
+            self.assertEqual(p.stderr, b"")
+            return p.returncode, p.stdout.decode('utf-8')
+
+        status, out = run("json", "Tests/colors.svg", "Tests/good.svg")
+        self.assertEqual(status, 1)
+        files = json.loads(out)['files']
+        self.assertEqual([(f['file'], f['ok']) for f in files],
+                         [("Tests/colors.svg", False), ("Tests/good.svg", True)])
+        self.assertEqual(len(files[0]['diagnostics']), 12)
+        self.assertEqual(files[0]['diagnostics'][0],
+                         {'rule': 'value-not-allowed', 'severity': 'warning',
+                          'message': "The attribute 'fill' does not allow the value 'red',"
+                                     " replaced with 'black'",
+                          'file': 'Tests/colors.svg', 'line': 2, 'element': 'circle',
+                          'attribute': 'fill', 'old': 'red', 'new': 'black',
+                          'action': 'replaced'})
+
+        status, out = run("ndjson", "Tests/good.svg", "Tests/rfc.xml", "Tests/malformed.svg")
+        lines = [json.loads(line) for line in out.splitlines()]
+        self.assertEqual([line['file'] for line in lines],
+                         ["Tests/good.svg", "Tests/rfc.xml", "Tests/malformed.svg"])
+        self.assertEqual(lines[1]['diagnostics'][0]['line'], 24)
+        self.assertEqual([(d['rule'], d['action']) for d in lines[2]['diagnostics']][1:4],
+                         [('style-malformed', 'removed'), ('style-removed', 'removed'),
+                          ('style-removed', 'removed')])
+
+        p = subprocess.run([sys.executable, test_program, "--format=ndjson"], input=b"<svg",
+                           capture_output=True)
+        diagnostic = json.loads(p.stdout)['diagnostics'][0]
+        self.assertEqual((diagnostic['rule'], diagnostic['severity']), ('parse-error', 'error'))
+
+        status, out = run("sarif", "Tests/colors.svg")
+        sarif = json.loads(out)
+        self.assertEqual(sarif['version'], '2.1.0')
+        result = sarif['runs'][0]['results'][0]
+        self.assertEqual(result['ruleId'], 'value-not-allowed')
+        self.assertEqual(result['level'], 'warning')
+        self.assertEqual(result['locations'][0]['physicalLocation'],
+                         {'artifactLocation': {'uri': 'Tests/colors.svg'},
+                          'region': {'startLine': 2}})
+        self.assertEqual(result['properties']['action'], 'replaced')
+
+    def test_format_and_text(self):
+        # Text written to stderr by workers stays out of the results
+        def run(*args):
+            p = subprocess.run([sys.executable, test_program] + list(args), capture_output=True)
+            return p.returncode, p.stdout.decode('utf-8'), p.stderr.decode('utf-8')
+
+        status, out, err = run("-j2", "--format=ndjson", "--profile", "Tests/good.svg",
+                               "Tests/colors.svg")
+        self.assertEqual(status, 1)
+        self.assertEqual([json.loads(line)['file'] for line in out.splitlines()],
+                         ["Tests/good.svg", "Tests/colors.svg"])
+        self.assertIn("Tests/colors.svg", err)
+
+        status, out, err = run("-j2", "--format=json", "Tests/good.svg", "Tests/missing.svg")
+        self.assertEqual(status, 1)
+        missing = json.loads(out)['files'][1]
+        self.assertEqual((missing['file'], missing['ok'], missing['diagnostics'][0]['rule']),
+                         ("Tests/missing.svg", False, 'file-missing'))
+        self.assertEqual(err, "")
+
+        status, out, err = run("--format=json", "Tests/missing.svg")
+        self.assertEqual((status, json.loads(out)['files'][0]['status'], err), (1, 1, ""))
+
+        tree = 'Temp/format-tree'
+        if os.path.exists(tree):
+            shutil.rmtree(tree)
+        os.makedirs(tree)
+        shutil.copy('Tests/colors.svg', tree + '/colors.svg')
+        shutil.copy('Tests/good.svg', tree + '/good.svg')
+        status, out, err = run("--recursive", tree, "--format=json", "--profile")
+        self.assertEqual(status, 1)
+        self.assertEqual(len(json.loads(out)['files']), 2)
+        self.assertRegex(err, r"diagnostics +12\n")
+
+    def test_limits(self):
+        p = subprocess.run([sys.executable, test_program, "--max-bytes=1000", "Tests/good.svg"],
+                           capture_output=True)
+        self.assertEqual(p.returncode, 3)
+        self.assertEqual(p.stderr.decode('utf-8'),
+                         "ERROR: Resource limit exceeded: Tests/good.svg is 1440 bytes,"
+                         " more than 1000\n"
+                         "ERROR: File goes over a resource limit and was not checked\n")
+
+        # stdin is not read past the limit
+        p = subprocess.run([sys.executable, test_program, "--max-bytes=10"],
+                           input=b'<svg viewBox="0 0 1 1"/>' + b' ' * 100000, capture_output=True)
+        self.assertEqual(p.returncode, 3)
+        self.assertIn(b"<stdin> is more than 10 bytes", p.stderr)
+
+        p = subprocess.run([sys.executable, test_program, "--max-attribute-length=5",
+                            "--format=ndjson", "--check-only", "--stream", "Tests/good.svg",
+                            "Tests/colors.svg"], capture_output=True)
+        self.assertEqual(p.returncode, 3)
+        results = [json.loads(line) for line in p.stdout.splitlines()]
+        self.assertEqual([result['status'] for result in results], [3, 3])
+        self.assertEqual(results[0]['diagnostics'][0]['rule'], 'limit-exceeded')
+        self.assertEqual(results[0]['diagnostics'][0]['line'], 2)
+
     def test_stdin(self):
         process = subprocess.Popen([sys.executable, test_program],
                                    stdin=subprocess.PIPE,
@@ -75,6 +229,18 @@ class TestCommandLineOptions(unittest.TestCase):
         self.assertEqual(stderr_data.decode("utf-8").strip(),
                          "INFO: File conforms to SVG requirements.")
 
+    def test_stdin_diagnostics(self):
+        with open('Tests/colors.svg', 'rb') as f:
+            data = f.read()
+        process = subprocess.Popen([sys.executable, test_program],
+                                   stdin=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        _, stderr_data = process.communicate(input=data)
+        returnValue = check_results(io.StringIO(stderr_data.decode("utf-8")),
+                                    "Results/colors-stdin.err")
+        self.assertFalse(returnValue, "Output to console is different")
+        self.assertEqual(process.returncode, 1)
+
     def test_no_such_file(self):
         file = "this_file_does_not_exist.svg"
         process = subprocess.Popen([sys.executable, test_program, file],
@@ -83,6 +249,305 @@ class TestCommandLineOptions(unittest.TestCase):
         self.assertEqual(stderr_data.decode("utf-8").strip(),
                          f"No such file: {file}")
 
+    def test_batch(self):
+        check_process(self, [sys.executable, test_program, "--jobs=2",
+                             "Tests/good.svg", "Tests/colors.svg"],
+                      "Results/empty", "Results/batch.err", None, None)
+
+    def test_batch_status(self):
+        good = subprocess.run([sys.executable, test_program, "Tests/good.svg",
+                               "Tests/good.svg"], capture_output=True)
+        self.assertEqual(good.returncode, 0)
+        bad = subprocess.run([sys.executable, test_program, "-j", "2", "Tests/good.svg",
+                              "Tests/colors.svg"], capture_output=True)
+        self.assertEqual(bad.returncode, 1)
+
+    def test_batch_usage(self):
+        for args in [["-j", "-1"], ["--repair"], ["--always-emit"]]:
+            p = subprocess.run([sys.executable, test_program] + args +
+                               ["Tests/good.svg", "Tests/colors.svg"], capture_output=True)
+            self.assertEqual(p.returncode, 2, p.stderr)
+            self.assertIn(b"error: ", p.stderr)
+            self.assertNotIn(b"Traceback", p.stderr)
+
+
+class TestStartup(unittest.TestCase):
+    """ Plain SVG files should not pay for importing xml2rfc """
+
+    # Importing svgcheck.run may take at most this share of the time taken to
+    # import xml2rfc, measured the same way on the same machine.  It is about
+    # a fifth here.
+    import_share = 0.5
+
+    def run_python(self, code, *options):
+        p = subprocess.run([sys.executable] + list(options) + ['-c', code],
+                           capture_output=True)
+        self.assertEqual(p.returncode, 0, p.stderr)
+        return p
+
+    def test_svg_without_xml2rfc(self):
+        p = self.run_python("import sys\n"
+                            "from svgcheck import run\n"
+                            "sys.argv = ['svgcheck', 'Tests/good.svg']\n"
+                            "try:\n"
+                            "    run.main()\n"
+                            "except SystemExit:\n"
+                            "    pass\n"
+                            "print('xml2rfc' in sys.modules)\n")
+        self.assertEqual(p.stdout.decode('utf-8').strip(), 'False')
+
+    def test_rfc_with_xml2rfc(self):
+        p = self.run_python("import sys\n"
+                            "from svgcheck import run\n"
+                            "sys.argv = ['svgcheck', 'Tests/rfc.xml']\n"
+                            "try:\n"
+                            "    run.main()\n"
+                            "except SystemExit:\n"
+                            "    pass\n"
+                            "print('xml2rfc' in sys.modules)\n")
+        self.assertEqual(p.stdout.decode('utf-8').strip(), 'True')
+
+    def import_time(self, module):
+        """ The time in microseconds taken to import module and what it imports """
+        p = self.run_python("import " + module, "-X", "importtime")
+        for line in p.stderr.decode('utf-8').splitlines():
+            fields = [field.strip() for field in line.split('|')]
+            if fields[-1] == module:
+                return int(fields[1])
+        self.fail(module + " was not imported")
+
+    def test_import_time(self):
+        self.assertLess(self.import_time('svgcheck.run'),
+                        self.import_time('xml2rfc') * self.import_share)
+
+
+class TestResultCache(unittest.TestCase):
+    """ Check that --cache-results replays results and evicts old ones """
+    def setUp(self):
+        self.cache = 'Temp/results_cache'
+        if os.path.exists(self.cache):
+            shutil.rmtree(self.cache)
+
+    def run_cached(self, *options):
+        return subprocess.run([sys.executable, test_program, "--cache-results",
+                               "--cache=" + self.cache] + list(options) + ["Tests/colors.svg"],
+                              capture_output=True)
+
+    def test_replay(self):
+        first = self.run_cached("--repair")
+        entries = os.listdir(os.path.join(self.cache, 'svgcheck'))
+        self.assertEqual(len(entries), 1)
+        path = os.path.join(self.cache, 'svgcheck', entries[0])
+        with open(path) as f:
+            entry = json.load(f)
+        self.assertEqual(entry['status'], 1)
+        self.assertEqual(entry['diagnostics'], first.stderr.decode('utf-8'))
+        self.assertEqual(entry['output'], first.stdout.decode('utf-8'))
+
+        # The second run must come from the cache
+        entry['diagnostics'] = 'From the cache\n'
+        with open(path, 'w') as f:
+            json.dump(entry, f)
+        second = self.run_cached("--repair")
+        self.assertEqual(second.returncode, 1)
+        self.assertEqual(second.stderr, b'From the cache\n')
+        self.assertEqual(second.stdout, first.stdout)
+
+        # Other options are another entry
+        third = self.run_cached("--repair", "--grey-scale")
+        self.assertNotEqual(third.stderr, b'From the cache\n')
+        self.assertEqual(len(os.listdir(os.path.join(self.cache, 'svgcheck'))), 2)
+
+    def test_incremental(self):
+        def run():
+            return subprocess.run([sys.executable, test_program, "--incremental",
+                                   "--cache=" + self.cache, "Tests/rfc.xml"],
+                                  capture_output=True)
+
+        first = run()
+        figures = os.path.join(self.cache, 'svgcheck', 'figures')
+        self.assertTrue(os.listdir(figures))
+        second = run()
+        self.assertEqual(second.returncode, first.returncode)
+        self.assertEqual(second.stderr, first.stderr)
+        self.assertEqual(second.stdout, first.stdout)
+
+        # The figure has findings, but as nothing is repaired it is not checked again
+        def visited():
+            p = subprocess.run([sys.executable, test_program, "--incremental",
+                                "--cache=" + self.cache, "--profile", "--profile-format=json",
+                                "Tests/rfc.xml"], capture_output=True)
+            self.assertEqual(p.returncode, 1)
+            return json.loads(p.stderr.decode('utf-8').splitlines()[-1])['elements']
+
+        self.assertEqual(visited(), {})
+
+    def test_not_read(self):
+        # Files over --max-bytes, and --stream, are not read to hash them
+        self.assertEqual(self.run_cached("--max-bytes=1000").returncode, 3)
+        self.assertEqual(self.run_cached("--check-only", "--stream").returncode, 1)
+        self.assertFalse(os.listdir(os.path.join(self.cache, 'svgcheck')))
+
+    def test_file_key(self):
+        from svgcheck.cache import ResultCache
+        from svgcheck import run
+        results = ResultCache(self.cache, 2500, 3600)
+        options = run.optparse.Values({'repair': True})
+        with open('Tests/colors.svg', 'rb') as f:
+            data = f.read()
+        self.assertEqual(run.file_key(results, options, 'Tests/colors.svg', size=200),
+                         results.key([data], options, 'Tests/colors.svg'))
+
+        # XInclude is found even when it is split between chunks
+        os.makedirs(self.cache)
+        path = os.path.join(self.cache, 'xinclude.svg')
+        with open(path, 'wb') as f:
+            f.write(b'<svg xmlns="http://www.w3.org/2000/svg">' + b' ' * 50 +
+                    b'<g xmlns:xi="http://www.w3.org/2001/XInclude"/></svg>')
+        for size in range(60, 120, 7):
+            self.assertIsNone(run.file_key(results, options, path, size=size))
+
+    def test_evict(self):
+        from svgcheck.cache import ResultCache
+        os.makedirs(self.cache)
+        results = ResultCache(self.cache, 2500, 3600)
+        now = time.time()
+        for i, age in enumerate([7200, 30, 20, 10]):
+            results.put(str(i), {'diagnostics': 'x' * 1000})
+            os.utime(results.path(str(i)), (now - age, now - age))
+        self.assertEqual(results.evict(), 2)
+        self.assertEqual(sorted(os.listdir(self.cache)), ['2.json', '3.json'])
+        self.assertIsNone(results.get('1'))
+        self.assertEqual(results.get('3'), {'diagnostics': 'x' * 1000})
+
+
+class TestProfile(unittest.TestCase):
+    """ Check the --profile reports """
+    def profile(self, *options):
+        p = subprocess.run([sys.executable, test_program, "--profile", "--profile-format=json"] +
+                           list(options) + ["Tests/colors.svg"], capture_output=True)
+        return json.loads(p.stderr.decode('utf-8').splitlines()[-1])
+
+    def test_profile(self):
+        profile = self.profile("--repair")
+        self.assertEqual(profile['source'], 'Tests/colors.svg')
+        self.assertEqual(list(profile['phases']),
+                         ['read', 'parse', 'check', 'serialize'])
+        for times in profile['phases'].values():
+            self.assertGreaterEqual(times['wall'], 0)
+            self.assertGreaterEqual(times['cpu'], 0)
+        self.assertEqual(profile['elements']['circle'], {'visited': 16})
+        self.assertEqual(profile['attributes']['fill'], {'visited': 16, 'rewritten': 12})
+        self.assertGreater(profile['value_ok_calls'], 16)
+
+        stream = self.profile("--check-only", "--stream")
+        self.assertEqual(list(stream['phases']), ['read', 'parse and check'])
+        for counts in ('elements', 'attributes', 'value_ok_calls'):
+            self.assertEqual(stream[counts], profile[counts])
+
+    def test_profile_dump(self):
+        if not os.path.exists('Temp'):
+            os.mkdir('Temp')
+        dump = 'Temp/svgcheck.prof'
+        p = subprocess.run([sys.executable, test_program, "--profile-dump=" + dump,
+                            "Tests/good.svg"], capture_output=True)
+        self.assertEqual(p.returncode, 0)
+        import pstats
+        stats = pstats.Stats(dump)
+        self.assertTrue(any(function == 'check_tree' for _, _, function in stats.stats))
+
+
+class TestBench(unittest.TestCase):
+    """ Make sure the benchmarks still run """
+    def test_bench(self):
+        baseline = 'Temp/bench.json'
+        p = subprocess.run([sys.executable, 'bench.py', '--sizes=100', '--repeat=1',
+                            '--save=' + baseline], capture_output=True)
+        self.assertEqual(p.returncode, 0, p.stderr)
+        with open(baseline) as f:
+            results = json.load(f)
+        for name in ['good.svg', 'rfc-svg.xml', 'flat-100', 'deep-100', 'attrs-100']:
+            self.assertEqual(sorted(results[name]['time']), ['check', 'parse', 'serialize'])
+
+        # Everything is more than twice as slow as the baseline
+        for result in results.values():
+            for phase in result['time']:
+                result['time'][phase] /= 1000
+        with open(baseline, 'w') as f:
+            json.dump(results, f)
+        p = subprocess.run([sys.executable, 'bench.py', '--sizes=100', '--repeat=1',
+                            '--no-fixtures', '--kinds=attrs', '--compare=' + baseline,
+                            '--tolerance=100'], capture_output=True)
+        self.assertEqual(p.returncode, 1)
+        self.assertIn(b'SLOWER: attrs-100', p.stdout)
+
+    def test_compare_memory(self):
+        """ Peak memory growth is compared like time, unless it is unknown or small """
+        def result(memory):
+            return {'time': dict((phase, 1.0) for phase in bench.phases),
+                    'memory': dict((phase, memory) for phase in bench.phases)}
+        baseline = {'a': result(10000), 'b': result(None), 'c': result(10)}
+        results = {'a': result(15000), 'b': result(15000), 'c': result(500)}
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            self.assertEqual(bench.compare(results, baseline, 0.25), len(bench.phases))
+        self.assertEqual(out.getvalue().count('LARGER: a '), len(bench.phases))
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(bench.compare(results, baseline, 0.6), 0)
+
+
+class TestServe(unittest.TestCase):
+    """ Run svgcheck --serve on a localhost port and make requests of it """
+    @classmethod
+    def setUpClass(cls):
+        cls.server = subprocess.Popen([sys.executable, test_program, "--serve=127.0.0.1:0",
+                                       "--max-request-size=100000"],
+                                      stderr=subprocess.PIPE)
+        line = cls.server.stderr.readline().decode('utf-8')
+        cls.port = int(line.rstrip().rstrip('/').rsplit(':', 1)[1])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.terminate()
+        cls.server.wait()
+        cls.server.stderr.close()
+
+    def post(self, path, body):
+        connection = http.client.HTTPConnection('127.0.0.1', self.port)
+        connection.request('POST', path, body)
+        response = connection.getresponse()
+        reply = response.read()
+        connection.close()
+        return response.status, reply
+
+    def test_check(self):
+        with open('Tests/colors.svg', 'rb') as f:
+            status, reply = self.post('/?repair=1&name=Tests/colors.svg', f.read())
+        self.assertEqual(status, 200)
+        reply = json.loads(reply)
+        self.assertFalse(reply['ok'])
+        with open('Results/colors.err', encoding='utf-8') as f:
+            self.assertEqual(reply['diagnostics'], f.read().splitlines())
+        with open('Results/colors.out', encoding='utf-8') as f:
+            self.assertEqual(reply['output'], f.read())
+
+    def test_too_large(self):
+        status, _ = self.post('/', b' ' * 100001)
+        self.assertEqual(status, 413)
+
+    def test_not_socket(self):
+        """ An existing file is not replaced by the socket """
+        if not os.path.exists('Temp'):
+            os.mkdir('Temp')
+        path = os.path.join('Temp', 'serve.sock')
+        with open(path, 'w') as f:
+            f.write('keep')
+        p = subprocess.run([sys.executable, test_program, "--serve=" + path],
+                           capture_output=True, timeout=60)
+        self.assertEqual(p.returncode, 1)
+        self.assertIn(b"Not a socket", p.stderr)
+        with open(path) as f:
+            self.assertEqual(f.read(), 'keep')
+
 
 class TestParserMethods(unittest.TestCase):
 
@@ -130,6 +595,17 @@ class TestParserMethods(unittest.TestCase):
                       "Results/rfc-01.out", "Results/rfc-01.err",
                       "Results/rfc-01.xml", "Temp/rfc.xml")
 
+    def test_out_bytes(self):
+        if not os.path.exists('Temp'):
+            os.mkdir('Temp')
+        args = [sys.executable, test_program, "--always-emit", "Tests/colors.svg"]
+        p = subprocess.run(args, capture_output=True)
+        subprocess.run(args + ["--out=Temp/colors.svg"], capture_output=True)
+        with open("Temp/colors.svg", "rb") as f:
+            written = f.read()
+        self.assertEqual(written, p.stdout)
+        self.assertTrue(written.startswith(b"<?xml version='1.0' encoding='utf-8'?>\n"))
+
     def test_to_stdout(self):
         check_process(self, [sys.executable, test_program, "--repair",
                              "Tests/rfc.xml"], "Results/rfc-02.out", "Results/rfc-02.err",
@@ -171,6 +647,16 @@ class TestParserMethods(unittest.TestCase):
                       "Results/full-tiny-02.out", "Results/full-tiny-02.err",
                       None, None)
 
+    def test_stream(self):
+        check_process(self, [sys.executable, test_program, "--check-only", "--stream",
+                             "Tests/malformed.svg"],
+                      "Results/empty", "Results/malformed-stream.err", None, None)
+
+    def test_stream_rfc(self):
+        check_process(self, [sys.executable, test_program, "--check-only", "--stream",
+                             "Tests/rfc-svg.xml"],
+                      "Results/empty", "Results/rfc-svg.err", None, None)
+
     def test_utf8(self):
         check_process(self, [sys.executable, test_program, "-r", "Tests/utf8.svg"],
                       "Results/utf8.out", "Results/utf8.err", None, None)
@@ -205,6 +691,462 @@ class TestViewBox(unittest.TestCase):
         test_svg_file(self, "viewBox-both.svg")
 
 
+class TestLog(unittest.TestCase):
+    def test_note_is_lazy(self):
+        class Counted(object):
+            calls = 0
+
+            def __str__(self):
+                Counted.calls += 1
+                return "counted"
+
+        saved = (log.verbose, log.write_err)
+        log.write_err = io.StringIO()
+        try:
+            log.verbose = False
+            self.assertFalse(log.is_verbose())
+            log.note("value %s", Counted())
+            self.assertEqual(Counted.calls, 0)
+            log.verbose = True
+            self.assertTrue(log.is_verbose())
+            log.note("value %s", Counted())
+            self.assertEqual(Counted.calls, 1)
+            self.assertEqual(log.write_err.getvalue(), "value counted\n")
+        finally:
+            (log.verbose, log.write_err) = saved
+
+
+class TestRules(unittest.TestCase):
+    def test_children_are_not_substrings(self):
+        self.assertIn('text', checksvg.element_children['desc'])
+        self.assertNotIn('ex', checksvg.element_children['desc'])
+
+    def test_tbreak_attributes(self):
+        self.assertIn('lang', checksvg.element_attributes['tspan'])
+        self.assertNotIn('<tbreak>', checksvg.element_attributes['tspan'])
+
+    def test_value_ok(self):
+        self.assertEqual(checksvg.value_ok('fill', 'none'), (True, 'none'))
+        self.assertEqual(checksvg.value_ok('fill', 'red'), (False, 'black'))
+        self.assertEqual(checksvg.value_ok('stroke', '#FFFFFF'), (True, '#FFFFFF'))
+        self.assertEqual(checksvg.value_ok('cx', '1.5'), (True, '1.5'))
+        self.assertEqual(checksvg.value_ok('font-family', 'Arial,serif'),
+                         (False, 'serif'))
+        self.assertEqual(checksvg.value_ok('fill', ''), (False, 'black'))
+
+    def test_value_cache_threshold(self):
+        saved = wp.color_threshold
+        try:
+            self.assertEqual(checksvg.value_ok('fill', '#aaaaaa'), (False, 'black'))
+            wp.color_threshold = 381
+            self.assertEqual(checksvg.value_ok('fill', '#aaaaaa'), (False, 'white'))
+        finally:
+            wp.color_threshold = saved
+
+    def test_parse_color(self):
+        self.assertEqual(checksvg.parse_color('#a0b'), (170, 0, 187))
+        self.assertEqual(checksvg.parse_color('#a0b0c0'), (160, 176, 192))
+        self.assertEqual(checksvg.parse_color('rgb( 1, 2.5 ,3 )'), (1, 2.5, 3))
+        self.assertEqual(checksvg.parse_color('rgb(100%,0%,50%)'), (255, 0, 127.5))
+        self.assertEqual(checksvg.parse_color('lightgrey'), (211, 211, 211))
+        for bad in ['rgb(a,b)', 'rgb(1,2)', '#abcd', '#ggg', 'rgb(1,2,3', 'unknown', '']:
+            self.assertIsNone(checksvg.parse_color(bad), bad)
+
+    def test_split_style(self):
+        self.assertEqual(checksvg.split_style('fill:red; stroke : blue;'),
+                         [('fill', 'red'), ('stroke', 'blue')])
+        self.assertEqual(checksvg.split_style('fill:url(http://example.com/a.svg#p);'
+                                              'font-family:"a;b:c", serif'),
+                         [('fill', 'url(http://example.com/a.svg#p)'),
+                          ('font-family', '"a;b:c", serif')])
+        self.assertEqual(checksvg.split_style(';fill:red/* a:b; */; ;'), [('fill', 'red')])
+        self.assertEqual(checksvg.split_style('malformed;a:b:c;:red'),
+                         [(None, 'malformed'), (None, 'a:b:c'), (None, ':red')])
+
+    def test_parse_style_cache(self):
+        style = 'fill:#123456;stroke:url(http://example.com/a.svg);opacity:0.5;bad'
+        self.assertEqual(checksvg.parse_style(style),
+                         (('promote', 'fill', '#123456'),
+                          ('promote', 'stroke', 'url(http://example.com/a.svg)'),
+                          ('remove', 'opacity', '0.5'),
+                          ('malformed', None, 'bad')))
+        svg = ('<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 1 1">' +
+               '<rect style="{0}"/>'.format(style) * 100 + '</svg>')
+        before = checksvg.parse_style.cache_info()
+        checksvg.Checker(sink=io.StringIO()).check_tree(
+            lxml.etree.ElementTree(lxml.etree.fromstring(svg)))
+        after = checksvg.parse_style.cache_info()
+        self.assertEqual(after.misses, before.misses)
+        self.assertEqual(after.hits, before.hits + 100)
+
+    def test_name_cache(self):
+        svg = ('<svg xmlns="http://www.w3.org/2000/svg" xmlns:x="http://example.com/x"'
+               ' viewBox="0 0 1 1">' +
+               '<rect width="1" fill="red" x:y="1"/><x:foo/><text foo="1">t</text>' * 500 +
+               '</svg>')
+        checker = checksvg.Checker(sink=io.StringIO())
+        checker.check_tree(lxml.etree.ElementTree(lxml.etree.fromstring(svg)))
+        svg_tag = '{http://www.w3.org/2000/svg}'
+        self.assertEqual(sorted(checker.tag_names),
+                         ['{http://example.com/x}foo', svg_tag + 'rect', svg_tag + 'svg',
+                          svg_tag + 'text'])
+        self.assertEqual(checker.tag_names['{http://example.com/x}foo'],
+                         checksvg.TagName('foo', 'http://example.com/x', False, False))
+        rect = checker.attribute_names['rect']
+        self.assertEqual(sorted(rect), ['fill', 'width', '{http://example.com/x}y'])
+        self.assertEqual(rect['fill'],
+                         checksvg.AttributeName('fill', None, False, False, True, True))
+        self.assertEqual(rect['{http://example.com/x}y'],
+                         checksvg.AttributeName('y', 'http://example.com/x', False, False,
+                                                True, True))
+        self.assertFalse(checker.attribute_names['text']['foo'].allowed)
+
+    def test_color_verdict(self):
+        self.assertEqual(checksvg.value_ok('fill', 'rgb(a,b)'), (False, 'black'))
+        self.assertEqual(checksvg.value_ok('fill', '#GGG'), (False, 'black'))
+        self.assertEqual(checksvg.color_verdict('lightgrey', 381), 'white')
+        self.assertEqual(checksvg.color_verdict('lightgrey', 764), 'black')
+        self.assertEqual(checksvg.color_verdict('rgb(51%,50%,50%)', 381), 'white')
+        self.assertEqual(checksvg.color_verdict('rgb(49%,50%,50%)', 381), 'black')
+        self.assertEqual(checksvg.color_verdict('rgb(0,0,0)', 0), 'black')
+
+    def test_parse_path(self):
+        self.assertEqual(checksvg.parse_path('M 10,20 l5 .5-1e2 0z'),
+                         ([('M', ['10', '20']), ('l', ['5', '.5']), ('l', ['-1e2', '0']),
+                           ('z', [])], None))
+        self.assertEqual(checksvg.parse_path('M 1 1 2 2 m 3 3 4 4')[0],
+                         [('M', ['1', '1']), ('L', ['2', '2']), ('m', ['3', '3']),
+                          ('l', ['4', '4'])])
+        self.assertEqual(checksvg.parse_path('M0 0 a 5 5 0 1,0 10 10')[0][1],
+                         ('a', ['5', '5', '0', '1', '0', '10', '10']))
+        self.assertEqual(checksvg.parse_path(' L 1 1'),
+                         ([], (1, 'path data must start with a moveto')))
+        self.assertEqual(checksvg.parse_path('M 1 1 L 2 x'),
+                         ([('M', ['1', '1'])], (10, "expected a number for 'L', found 'x'")))
+        self.assertEqual(checksvg.parse_path('M0 0 A 1 1 0 2 0 1 1')[1],
+                         (13, "expected a flag of 0 or 1 for 'A', found '2'"))
+        self.assertEqual(checksvg.parse_path('M0 0 Z 1')[1], (7, "unexpected '1'"))
+        self.assertEqual(checksvg.parse_points('1, 2 3'),
+                         (['1', '2'], (6, 'a coordinate has no y')))
+        self.assertEqual(checksvg.parse_points('nan')[1], (0, "expected a number, found 'n'"))
+
+    def test_compact_path(self):
+        def compact(d, precision=None):
+            return checksvg.compact_path(checksvg.parse_path(d)[0], precision)
+
+        self.assertEqual(compact('M 10 20 L 30 40 L -5.50 +0.250 Z'), 'M10 20 30 40-5.5.25Z')
+        self.assertEqual(compact('m 1 1 l 2 2 L 3 3 z M 0 0 Z'), 'm1 1 2 2L3 3zM0 0Z')
+        self.assertEqual(compact('M 1 1 2 2'), 'M1 1 2 2')
+        self.assertEqual(compact('m 72,72 648,0 0,10'), 'm72 72 648 0 0 10')
+        self.assertEqual(compact('M 1 1 2 2 M 3 3'), 'M1 1 2 2M3 3')
+
+        # Compacting does not change what is drawn
+        def values(segments):
+            return [(command, [float(n) for n in numbers]) for command, numbers in segments]
+
+        for path in lxml.etree.parse('Tests/svg-wordle.svg').iter('{*}path'):
+            segments = checksvg.parse_path(path.get('d'))[0]
+            again, problem = checksvg.parse_path(checksvg.compact_path(segments))
+            self.assertIsNone(problem)
+            self.assertEqual(values(again), values(segments))
+        self.assertEqual(compact('M0 0 a 0.5 0.5 0 1 0 0.5 0.5'), 'M0 0a.5.5 0 10.5.5')
+        self.assertEqual(compact('M 1.26 -0.04 L 2.001 3', 1), 'M1.3 0 2 3')
+        self.assertEqual(checksvg.compact_points(['1.0', '-2', '0.5', '.5']), '1-2 .5.5')
+
+    def test_value_cache_tables(self):
+        saved = wp.properties
+        try:
+            self.assertEqual(checksvg.value_ok('fill-rule', 'odd'), (False, None))
+            wp.properties = dict(saved, **{'fill-rule': ('odd',)})
+            checksvg.checkTree(lxml.etree.ElementTree(lxml.etree.fromstring(
+                '<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 1 1"/>')))
+            self.assertEqual(checksvg.value_ok('fill-rule', 'odd'), (True, 'odd'))
+        finally:
+            wp.properties = saved
+            checksvg.compile_rules()
+
+
+class TestChecker(unittest.TestCase):
+    grey = (b'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 10 10">'
+            b'<rect width="10" height="10" fill="#aaaaaa" style="stroke:#aaaaaa"/></svg>')
+
+    def test_concurrent_checkers(self):
+        results = {}
+
+        def run(threshold):
+            sink = io.StringIO()
+            checker = checksvg.Checker(color_threshold=threshold, sink=sink)
+            for _ in range(50):
+                tree = lxml.etree.ElementTree(lxml.etree.fromstring(self.grey))
+                ok = checker.check_tree(tree)
+            results[threshold] = (ok, checker.error_count, tree.getroot()[0].get('fill'),
+                                  sink.getvalue())
+
+        threads = [threading.Thread(target=run, args=(t,)) for t in (764, 381)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(results[764][2], 'black')
+        self.assertEqual(results[381][2], 'white')
+        for threshold in (764, 381):
+            ok, error_count, fill, diagnostics = results[threshold]
+            self.assertFalse(ok)
+            self.assertEqual(error_count, 2)
+            self.assertEqual(diagnostics.count("promoted"), 50)
+            self.assertIn("promoted to attribute", diagnostics)
+            self.assertIn("#aaaaaa", diagnostics)
+
+    def test_no_repair(self):
+        svg = (b'<svg xmlns="http://www.w3.org/2000/svg"><rect fill="red" style="stroke:red"/>'
+               b'<foo/><text font-size="10">x</text></svg>')
+        tree = lxml.etree.ElementTree(lxml.etree.fromstring(svg))
+        checker = checksvg.Checker(repair=False, sink=io.StringIO())
+        self.assertFalse(checker.check_tree(tree))
+        self.assertEqual(lxml.etree.tostring(tree), svg)
+
+        repairer = checksvg.Checker(sink=io.StringIO())
+        self.assertFalse(repairer.check_tree(lxml.etree.ElementTree(lxml.etree.fromstring(svg))))
+        self.assertEqual(checker.error_count, repairer.error_count)
+        self.assertEqual(checker.log.write_err.getvalue(), repairer.log.write_err.getvalue())
+
+    def test_fail_fast(self):
+        svg = (b'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 1 1" style="fill:#fe0000">'
+               b'<rect fill="#fe0001"/><foo/></svg>')
+        tree = lxml.etree.ElementTree(lxml.etree.fromstring(svg))
+        checker = checksvg.Checker(fail_fast=True, repair=True, sink=io.StringIO())
+        misses = checksvg.color_verdict.cache_info().misses
+        self.assertFalse(checker.check_tree(tree))
+        self.assertEqual(lxml.etree.tostring(tree), svg)
+        self.assertEqual(checksvg.color_verdict.cache_info().misses, misses)
+        self.assertEqual(checker.log.write_err.getvalue(),
+                         "<unknown>:1: Style property 'fill' promoted to attribute\n"
+                         "<unknown>:1: The attribute 'fill' does not allow the value '#fe0000'\n")
+
+        # The verdicts agree with checking everything
+        for text in (self.grey, b'<svg xmlns="http://www.w3.org/2000/svg" style="foo:bar"/>'):
+            verdicts = set()
+            for fail_fast in (False, True):
+                tree = lxml.etree.ElementTree(lxml.etree.fromstring(text))
+                checker = checksvg.Checker(fail_fast=fail_fast, sink=io.StringIO())
+                verdicts.add(checker.check_tree(tree))
+            self.assertEqual(len(verdicts), 1)
+
+    def test_limits(self):
+        def check(text, **limits):
+            checker = checksvg.Checker(sink=io.StringIO(), limits=checksvg.Limits(**limits))
+            try:
+                checker.prescan(text)
+                checker.check_tree(lxml.etree.ElementTree(lxml.etree.fromstring(text)))
+            except checksvg.LimitExceeded:
+                return checker.log.write_err.getvalue()
+            return None
+
+        svg = (b'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 1 1"><!-- <x> -->'
+               b'<g><g><rect width="10"/></g></g></svg>')
+        self.assertIsNone(check(svg, bytes=len(svg), elements=4, depth=3, attribute_length=7))
+        self.assertEqual(check(svg, bytes=100),
+                         "ERROR: Resource limit exceeded: the document is more than 100 bytes\n")
+        self.assertIn("has 4 elements, more than 3", check(svg, elements=3))
+        self.assertIn("nested more than 2 deep", check(svg, depth=2))
+        self.assertIn("'viewBox' is 7 characters long, more than 6",
+                      check(svg, attribute_length=6))
+
+        # Every element counts, not only those in svg elements
+        rfc = b'<rfc>' + svg + svg + b'</rfc>'
+        self.assertIsNone(check(rfc, figures=2, elements=9))
+        self.assertIn("has 9 elements, more than 8", check(rfc, elements=8))
+        checker = checksvg.Checker(sink=io.StringIO(), limits=checksvg.Limits(elements=8))
+        with self.assertRaises(checksvg.LimitExceeded):
+            checker.check_tree(lxml.etree.ElementTree(lxml.etree.fromstring(rfc)))
+        checker = checksvg.Checker(sink=io.StringIO(), limits=checksvg.Limits(elements=8))
+        with self.assertRaises(checksvg.LimitExceeded):
+            checker.check_stream(lxml.etree.iterparse(io.BytesIO(rfc), events=("start", "end")))
+        self.assertIn("more than 1 svg elements", check(rfc, figures=1))
+
+    def test_optimize(self):
+        svg = (b'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 10 10">'
+               b'<path d="M 1.000 2.000 L 3.125 4"/><rect d="M 1 1"/>'
+               b'<polygon points="1, 2 3, 4 x"/><polyline points="nan"/></svg>')
+        tree = lxml.etree.ElementTree(lxml.etree.fromstring(svg))
+        checker = checksvg.Checker(sink=io.StringIO(), optimize=True, precision=2)
+        self.assertTrue(checker.check_tree(tree))
+        path, rect, polygon, polyline = tree.getroot()
+        self.assertEqual(path.get('d'), 'M1 2 3.12 4')
+        self.assertEqual(rect.get('d'), 'M 1 1')
+        self.assertEqual(polygon.get('points'), '1 2 3 4')
+        self.assertIsNone(polyline.get('points'))
+        self.assertEqual(checker.log.write_err.getvalue(),
+                         "<unknown>:1: The attribute 'points' is malformed at character 10:"
+                         " expected a number, found 'x', replaced with '1 2 3 4'\n"
+                         "<unknown>:1: The attribute 'points' is malformed at character 0:"
+                         " expected a number, found 'n', attribute to be removed\n")
+
+        tree = lxml.etree.ElementTree(lxml.etree.fromstring(svg))
+        self.assertTrue(checksvg.Checker(sink=io.StringIO(), repair=False,
+                                         optimize=True).check_tree(tree))
+        self.assertEqual(lxml.etree.tostring(tree), svg)
+
+    def test_prune(self):
+        svg = (b'<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink"'
+               b' viewBox="0 0 9 9" fill-rule="nonzero">'
+               b'<g><rect fill="white" visibility="visible"/><rect fill="white"/><title/></g>'
+               b'<g><defs/></g><g id="a"/>'
+               b'<defs><path id="p" fill="black"/></defs><use xlink:href="#p" fill="black"/>'
+               b'<text fill="black">a<tspan fill="inherit">b</tspan></text></svg>')
+        tree = lxml.etree.ElementTree(lxml.etree.fromstring(svg))
+        checker = checksvg.Checker(sink=io.StringIO(), optimize=True)
+        self.assertTrue(checker.check_tree(tree))
+        self.assertEqual(lxml.etree.tostring(tree),
+                         b'<svg xmlns="http://www.w3.org/2000/svg"'
+                         b' xmlns:xlink="http://www.w3.org/1999/xlink" viewBox="0 0 9 9">'
+                         b'<g fill="white"><rect/><rect/><title/></g><g id="a"/>'
+                         b'<defs><path id="p" fill="black"/></defs><use xlink:href="#p"/>'
+                         b'<text>a<tspan>b</tspan></text></svg>')
+        self.assertEqual(checker.log.write_err.getvalue(), '')
+
+        tree = lxml.etree.ElementTree(lxml.etree.fromstring(svg))
+        checksvg.Checker(sink=io.StringIO(), optimize=True, repair=False).check_tree(tree)
+        self.assertEqual(lxml.etree.tostring(tree), svg)
+
+    def test_incremental(self):
+        class Store(dict):
+            def put(self, key, entry):
+                self[key] = json.loads(json.dumps(entry))
+
+        figure = ('<figure><artwork type="svg"><svg xmlns="http://www.w3.org/2000/svg" '
+                  'viewBox="0 0 1 1">\n'
+                  '<rect fill="{0}"/>\n</svg></artwork></figure>\n')
+        rfc = '<rfc>\n{0}{1}{2}</rfc>'
+
+        def run(text, repair=False):
+            tree = lxml.etree.ElementTree(lxml.etree.fromstring(text.encode('utf-8')))
+            checker = checksvg.Checker(repair=repair, sink=io.StringIO(), figures=store)
+            ok = checker.check_tree(tree)
+            return ok, checker.error_count, checker.log.write_err.getvalue()
+
+        store = Store()
+        first = run(rfc.format(figure.format('red'), figure.format('black'), ''))
+        self.assertEqual(len(store), 2)
+        self.assertIn(':3: ', first[2])
+        self.assertEqual(first[1], 1)
+
+        # Unchanged figures come from the store, moved to where they now are
+        store.put = None
+        moved = run(rfc.format('\n\n', figure.format('red'), figure.format('black')))
+        self.assertEqual(moved[:2], first[:2])
+        self.assertEqual(moved[2], first[2].replace(':3: ', ':5: '))
+
+        # A changed figure is checked again
+        del store.put
+        changed = run(rfc.format(figure.format('red'), figure.format('blue'), ''))
+        self.assertEqual(len(store), 3)
+        self.assertEqual(changed[1], 2)
+
+        # A figure which needs repairs is checked again when repairing
+        repaired = run(rfc.format(figure.format('red'), figure.format('black'), ''), True)
+        self.assertEqual(repaired[1:], first[1:])
+
+
+class TestAio(unittest.TestCase):
+    """ Check the asyncio API """
+    def test_many(self):
+        from svgcheck import aio
+        with open("Tests/colors.svg", "rb") as f:
+            colors = f.read()
+
+        async def run():
+            return await asyncio.gather(*([aio.check_bytes(colors, name="colors.svg", repair=True)
+                                           for _ in range(20)] +
+                                          [aio.check_file("Tests/good.svg"),
+                                           aio.check_bytes(b"<svg", name="bad.svg")]))
+
+        results = asyncio.run(run())
+        self.assertEqual(len(set(results[:20])), 1)
+        self.assertFalse(results[0].ok)
+        self.assertTrue(results[0].error_count > 0)
+        self.assertTrue(results[0].diagnostics[0].startswith("colors.svg:"))
+        self.assertTrue(results[0].output.startswith(b"<?xml"))
+        self.assertTrue(results[20].ok)
+        self.assertIsNone(results[20].output)
+        self.assertFalse(results[21].ok)
+        self.assertIn("Unable to parse the XML document: bad.svg", results[21].diagnostics[0])
+
+    def test_timeout(self):
+        from svgcheck import aio
+        svg = (b'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 1 1">' +
+               b'<rect fill="red" style="stroke:red"/>' * 200000 + b'</svg>')
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+        async def run():
+            with self.assertRaises(asyncio.TimeoutError):
+                await aio.check_bytes(svg, timeout=0.05, executor=executor)
+            # The timed out check gives up its thread
+            return await aio.check_bytes(b'<svg xmlns="http://www.w3.org/2000/svg"/>',
+                                         timeout=1, executor=executor)
+
+        try:
+            self.assertIsInstance(asyncio.run(run()), aio.CheckResult)
+        finally:
+            executor.shutdown()
+
+    def test_limits(self):
+        from svgcheck import aio
+        with self.assertRaises(checksvg.LimitExceeded):
+            asyncio.run(aio.check_file("Tests/good.svg", limits=checksvg.Limits(bytes=1000)))
+
+    def test_cancel(self):
+        cancel = threading.Event()
+        cancel.set()
+        checker = checksvg.Checker(sink=io.StringIO(), cancel=cancel)
+        tree = lxml.etree.ElementTree(lxml.etree.fromstring(TestChecker.grey))
+        with self.assertRaises(checksvg.Cancelled):
+            checker.check_tree(tree)
+
+
+class TestDeepNesting(unittest.TestCase):
+    def nested(self, depth, leaf):
+        svg = "{http://www.w3.org/2000/svg}"
+        root = lxml.etree.Element(svg + "svg", viewBox="0 0 1 1")
+        el = root
+        for i in range(depth):
+            el = lxml.etree.SubElement(el, svg + "g")
+        lxml.etree.SubElement(el, svg + leaf)
+        return root
+
+    def test_deep_nesting(self):
+        """ Nesting far deeper than the recursion limit """
+        root = self.nested(sys.getrecursionlimit() * 20, "rect")
+        checker = checksvg.Checker(sink=io.StringIO())
+        self.assertTrue(checker.check_tree(root.getroottree()))
+        self.assertEqual(checker.log.write_err.getvalue(), "")
+
+    def test_deep_removal(self):
+        """ A bad leaf still removes the chain above it """
+        root = self.nested(sys.getrecursionlimit() * 20, "foreignObject")
+        checker = checksvg.Checker(sink=io.StringIO())
+        self.assertFalse(checker.check_tree(root.getroottree()))
+        self.assertEqual(len(root), 0)
+
+    def test_deep_file(self):
+        """ A file nested thousands deep parses, checks and streams """
+        if not os.path.exists('Temp'):
+            os.mkdir('Temp')
+        path = os.path.join('Temp', 'deep.svg')
+        with open(path, 'wb') as f:
+            f.write(lxml.etree.tostring(self.nested(2000, "rect")))
+        for args in [[], ["--check-only", "--stream"], ["--repair"]]:
+            p = subprocess.run([sys.executable, test_program] + args + [path],
+                               capture_output=True)
+            self.assertEqual(p.returncode, 0, p.stderr)
+            self.assertIn(b"File conforms to SVG requirements", p.stderr)
+        p = subprocess.run([sys.executable, test_program, "--max-depth=100", path],
+                           capture_output=True)
+        self.assertEqual(p.returncode, 3, p.stderr)
+        self.assertIn(b"nested more than 100 deep", p.stderr)
+
+
 def test_svg_file(tester, fileName):
     """ Run the basic tests for a single input file """
 